@@ -5,23 +5,46 @@ load_dotenv()
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, abort
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta, date
-from sqlalchemy import or_
+from sqlalchemy import or_, event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from calendar import monthrange
 import uuid
+import hashlib
+import hmac
+from functools import partial
 import random
 import time
-from flask import session
-from num2words import num2words
-import zipfile
+from flask import session, stream_with_context
+import click
 from io import BytesIO
 from flask_mail import Mail, Message
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'd1796a30d48ec0d90a4f5017022b0635ce64d059a27c594c6e44175a323729a8'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'database.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///' + os.path.join(basedir, 'database.db'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['PAYSLIP_CACHE_DIR'] = os.getenv('PAYSLIP_CACHE_DIR', os.path.join(app.instance_path, 'payslip_cache'))
+app.config['PAYSLIP_CACHE_MAX_BYTES'] = 512 * 1024 * 1024
+app.config['PDF_WORKERS'] = int(os.getenv('PDF_WORKERS', os.cpu_count() or 1)) # processes rendering bulk payslip PDFs
+# Password hashing runs in its own process pool (see passwords.py). PASSWORD_HASH_METHOD
+# is a Werkzeug method string such as 'scrypt' or 'pbkdf2:sha256:600000'; changing it
+# rehashes each user's password on their next login. PASSWORD_HASH_WORKERS=0 hashes in
+# the request thread. Past MAX_PENDING hashes in flight, requests wait up to
+# WAIT_SECONDS for a slot and then get a 503.
+app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.getenv('PASSWORD_HASH_MAX_PENDING', 4 * (os.cpu_count() or 1)))
+app.config['PASSWORD_HASH_WAIT_SECONDS'] = float(os.getenv('PASSWORD_HASH_WAIT_SECONDS', '5'))
+
+# SQLite tuning, applied to every new connection (see apply_sqlite_pragmas)
+app.config['SQLITE_JOURNAL_MODE'] = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+app.config['SQLITE_SYNCHRONOUS'] = 'NORMAL'
+app.config['SQLITE_BUSY_TIMEOUT'] = 5000         # ms to wait on a locked database before "database is locked"
+app.config['SQLITE_CACHE_SIZE'] = -64000         # negative = KiB, i.e. 64 MB page cache per connection
+app.config['SQLITE_MMAP_SIZE'] = 256 * 1024 * 1024
+app.config['SQLITE_TEMP_STORE'] = 'MEMORY'
 
 # Flask-Mail Configuration
 app.config['MAIL_SERVER'] = 'smtp.gmail.com'
@@ -30,17 +53,81 @@ app.config['MAIL_USE_TLS'] = True
 app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = 'autalyx@gmail.com'
+# Emails are queued in the OutboxEmail table; a background thread per worker
+# process sends them. Set to False when running `flask outbox-worker` separately.
+app.config['OUTBOX_WORKER_THREAD'] = os.getenv('OUTBOX_WORKER_THREAD', '1') == '1'
+app.config['ANNUAL_LEAVE_DAYS'] = int(os.getenv('ANNUAL_LEAVE_DAYS', 24)) # working days of leave per calendar year
+app.config['WARM_UP'] = os.getenv('WARM_UP', '0') == '1' # preload lazy modules at import, for pre-forking servers (gunicorn --preload)
+# Request instrumentation served on /metrics (HR only, or a bearer METRICS_TOKEN for scrapers).
+# With PROFILE_SLOW_MS set, PROFILE_SAMPLE_RATE of requests run under cProfile and
+# those slower than the threshold are dumped to PROFILE_DIR as .prof files.
+app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', '0') == '1'
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+app.config['PROFILE_SLOW_MS'] = os.getenv('PROFILE_SLOW_MS')
+app.config['PROFILE_SAMPLE_RATE'] = float(os.getenv('PROFILE_SAMPLE_RATE', '0.05'))
+app.config['PROFILE_DIR'] = os.getenv('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
 
 
 db = SQLAlchemy(app)
 mail = Mail(app)
+
+def apply_sqlite_pragmas(dbapi_connection, config):
+    """Runs the SQLITE_* pragmas from config on a raw sqlite3 connection."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}")
+    cursor.execute(f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}")
+    cursor.execute(f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT'])}")
+    cursor.execute(f"PRAGMA cache_size={int(config['SQLITE_CACHE_SIZE'])}")
+    cursor.execute(f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}")
+    cursor.execute(f"PRAGMA temp_store={config['SQLITE_TEMP_STORE']}")
+    cursor.close()
+
+with app.app_context():
+    if db.engine.dialect.name == 'sqlite':
+        @event.listens_for(db.engine, 'connect')
+        def _on_sqlite_connect(dbapi_connection, connection_record):
+            apply_sqlite_pragmas(dbapi_connection, app.config)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
-from payroll import calculate_payslip
+from outbox import batch_sent, drain_outbox, ensure_worker_thread, run_worker
+from payslip_pdf import PdfCache, cache_key, html_to_pdf, render_pdfs, stream_zip, weasyprint_available
+from payroll import (business_days_between, calculate_payslips, calculate_period_payslips, get_month_calendar,
+                     invalidate_month_calendar, period_label, sundays_between)
+from stats import attendance_stats, count_by_role, payroll_totals, sum_payslips
+from search import autocomplete, drop_search_index, ensure_search_index, search_filter
+from leave_intervals import drop_leave_index, ensure_leave_index, find_overlap, leaves_overlapping
+from metrics import RequestMetrics
+from synthetic import generate_organisation
+from exports import EXPORT_FORMATS, export_stream, keyset_batches
+from employee_import import ImportFileError, insert_users, read_sheet, validate_rows
+from passwords import HashingBusy, PasswordHasher
+
+password_hasher = PasswordHasher()
+password_hasher.init_app(app)
+
+request_metrics = None
+if app.config['METRICS_ENABLED']:
+    request_metrics = RequestMetrics()
+    with app.app_context():
+        request_metrics.init_app(app, db.engine)
+    batch_sent.connect(request_metrics.observe_mail_batch, weak=False)
 
 MAIN_SUPERVISOR_ID = 'MAIN_SUPERVISOR'
 
+# Rendered payslip PDFs, addressed by a hash of everything printed on them
+# (including the pay date, which is the day of download), so repeat downloads
+# on the same day skip WeasyPrint entirely.
+payslip_cache = PdfCache(app.config['PAYSLIP_CACHE_DIR'], app.config['PAYSLIP_CACHE_MAX_BYTES'])
+PAYSLIP_TEMPLATE = os.path.join(basedir, 'templates', 'payslip_pdf.html')
+
+def payslip_cache_key(employee, payslip, date_today):
+    return cache_key('payslip_pdf.html', os.path.getmtime(PAYSLIP_TEMPLATE), employee.employee_id, employee.role, payslip,
+                     date_today, get_company_info())
+PROCESSED_REQUESTS_LIMIT = 200 # history rows shown on the supervisor dashboard
+DEFAULT_PAGE_SIZE = 50 # employee listings are paged by employee_id (?after=<employee_id>&page_size=N)
+MAX_PAGE_SIZE = 500
+
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.String(50), unique=True, nullable=False)
@@ -55,8 +142,25 @@ class User(db.Model, UserMixin):
     supervisor_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     employees = db.relationship('User', backref=db.backref('supervisor', remote_side=[id]), lazy='dynamic')
     leave_requests = db.relationship('LeaveRequest', backref='employee', lazy='dynamic')
-    def set_password(self, password): self.password_hash = generate_password_hash(password)
-    def check_password(self, password): return check_password_hash(self.password_hash, password)
+    __table_args__ = (
+        db.Index('ix_user_supervisor_id', 'supervisor_id', 'employee_id'),
+        db.Index('ix_user_role', 'role'),
+    )
+    def set_password(self, password): self.password_hash = password_hasher.hash(password)
+    def check_password(self, password):
+        # A hash made with older parameters is replaced; the caller's commit saves it
+        matches, new_hash = password_hasher.verify(self.password_hash, password)
+        if new_hash: self.password_hash = new_hash
+        return matches
+
+@event.listens_for(User.__table__, 'after_create')
+def _create_search_index(target, connection, **kw):
+    # `user` is new, so whatever an existing user_fts holds is stale
+    if connection.dialect.name == 'sqlite': ensure_search_index(connection, rebuild=True)
+
+@event.listens_for(User.__table__, 'before_drop')
+def _drop_search_index(target, connection, **kw):
+    if connection.dialect.name == 'sqlite': drop_search_index(connection)
 
 class LeaveRequest(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -70,6 +174,19 @@ class LeaveRequest(db.Model):
     team_leader_name = db.Column(db.String(100))
     team_leader_mobile = db.Column(db.String(20))
     letter_path = db.Column(db.String(200))
+    __table_args__ = (
+        db.Index('ix_leave_request_user_status', 'user_id', 'status', 'start_date'),
+        db.Index('ix_leave_request_status_start', 'status', 'start_date'),
+    )
+
+@event.listens_for(LeaveRequest.__table__, 'after_create')
+def _create_leave_index(target, connection, **kw):
+    # leave_request is new, so boxes in an existing leave_interval are stale
+    if connection.dialect.name == 'sqlite': ensure_leave_index(connection, rebuild=True)
+
+@event.listens_for(LeaveRequest.__table__, 'before_drop')
+def _drop_leave_index(target, connection, **kw):
+    if connection.dialect.name == 'sqlite': drop_leave_index(connection)
 
 class Role(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -96,15 +213,16 @@ class PersonalTask(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     date = db.Column(db.Date, nullable=False)
     task_description = db.Column(db.Text, nullable=False)
+    __table_args__ = (db.Index('ix_personal_task_user_date', 'user_id', 'date'),)
 
 class PasswordResetOTP(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     otp_code = db.Column(db.String(6), nullable=False)
-    otp_code = db.Column(db.String(6), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_verified = db.Column(db.Boolean, default=False)
     user = db.relationship('User', backref=db.backref('otp_codes', lazy='dynamic'))
+    __table_args__ = (db.Index('ix_password_reset_otp_user_created', 'user_id', 'created_at'),)
 
 class Attendance(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -115,65 +233,152 @@ class Attendance(db.Model):
     
     user = db.relationship('User', foreign_keys=[user_id], backref='attendance_records')
     marker = db.relationship('User', foreign_keys=[marked_by])
+    # One row per employee per day so attendance writes can be upserts
+    __table_args__ = (db.Index('ux_attendance_user_date', 'user_id', 'date', unique=True),)
+
+class PayrollRun(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    period_start = db.Column(db.Date, nullable=False, unique=True) # first day of the month
+    period_end = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='Open') # 'Open' (kept up to date), 'Closed' (frozen)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    closed_at = db.Column(db.DateTime)
+    lines = db.relationship('PayrollLine', backref='run', lazy='dynamic')
+
+class PayrollLine(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('payroll_run.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    employee_name = db.Column(db.String(100), nullable=False)
+    gross_salary = db.Column(db.Float, nullable=False)
+    total_payable_days = db.Column(db.Integer, nullable=False)
+    per_day_salary = db.Column(db.Float, nullable=False)
+    deductible_leave_days = db.Column(db.Integer, nullable=False)
+    leave_dates = db.Column(db.Text) # comma separated '%d-%b' labels
+    deductions = db.Column(db.Float, nullable=False)
+    net_salary = db.Column(db.Float, nullable=False)
+    error = db.Column(db.String(200))
+    # Times the inputs changed since the line was computed (0 = up to date). A
+    # counter rather than a flag, so a save only clears changes it has seen.
+    dirty = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (db.Index('ux_payroll_line_run_user', 'run_id', 'user_id', unique=True),)
+
+class OutboxEmail(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    recipients = db.Column(db.Text, nullable=False) # comma separated
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    status = db.Column(db.String(20), nullable=False, default='Pending') # 'Pending', 'Sending', 'Failed'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claim = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_outbox_email_status_next', 'status', 'next_attempt_at'),
+        db.Index('ix_outbox_email_claim', 'claim'),
+    )
 
 @login_manager.user_loader
 def load_user(user_id): return db.session.get(User, int(user_id))
 
-@app.context_processor
-def inject_company_info():
-    try:
-        info = CompanyInfo.query.first()
-    except Exception:
-        # Table might not exist yet
-        info = None
-
-    if not info:
-        # Create default only if it doesn't exist (handle safely)
-        # Check if table exists by inspecting exception or just try/except the creation
-        try:
-             # This inner try/except attempts to create the default record.
-             # If table is missing, this commit will fail.
-             info = CompanyInfo(name="HR PRO SOLUTIONS", address="123 Business Park, Tech City, Bangalore - 560100", email="info@hrpro.com", phone="+91 9876543210")
-             db.session.add(info)
-             # db.session.commit() # Commit might fail if table missing.
-             # Actually, best to just return default dict if DB is not ready.
-             # We rely on an init-db command or the main block to create tables.
-             pass 
-        except:
-             db.session.rollback()
-    
-    # If still None (e.g. database locked or missing table), return placeholders
-    if not info or not hasattr(info, 'name'):
-          return dict(company={"name":"HR PRO","address":"Default Address","email":"info@hrpro.com","phone":"+91 9999999999"})
-    
-    # Create default roles if missing (Safely)
-    try:
-        if Role.query.count() == 0:
-            db.session.add(Role(name='HR', prefix='HR', base_role='hr'))
-            db.session.add(Role(name='Supervisor', prefix='SUP', base_role='supervisor'))
-            db.session.add(Role(name='Employee', prefix='EMP', base_role='employee'))
-            db.session.commit()
-    except:
-        db.session.rollback()
-    
-    # If still None (e.g. database locked), return placeholders
-    # Create default roles if missing
-    if Role.query.count() == 0:
+# In-process registry of role name (lower-cased) -> (name, base_role).
+# Loaded on first use, dropped by the routes that write Role rows and expired
+# after ROLE_REGISTRY_TTL seconds so edits made in other workers show up.
+ROLE_REGISTRY_TTL = 300
+_role_registry = {'loaded_at': None, 'roles': {}}
+
+def _get_role_registry():
+    loaded_at = _role_registry['loaded_at']
+    if loaded_at is None or time.monotonic() - loaded_at > ROLE_REGISTRY_TTL:
+        rows = db.session.query(Role.name, Role.base_role).all()
+        _role_registry['roles'] = {name.lower(): (name, base) for name, base in rows}
+        _role_registry['loaded_at'] = time.monotonic()
+    return _role_registry['roles']
+
+def invalidate_role_registry():
+    _role_registry['loaded_at'] = None
+
+def queue_email(*messages):
+    """Stores Flask-Mail messages in the outbox; they are sent by the outbox worker."""
+    if messages:
+        db.session.execute(db.insert(OutboxEmail), [
+            {'subject': msg.subject, 'recipients': ','.join(msg.recipients), 'body': msg.body, 'html': msg.html}
+            for msg in messages])
+    db.session.commit()
+    if app.config['OUTBOX_WORKER_THREAD']:
+        ensure_worker_thread(app, db, OutboxEmail, mail)
+
+def get_base_role(role_name):
+    """Returns the base role (hr, supervisor, employee) for a role name, or None if it is not a known Role."""
+    if not role_name: return None
+    entry = _get_role_registry().get(role_name.lower())
+    return entry[1] if entry else None
+
+def role_names_with_base(base_role):
+    return [name for name, base in _get_role_registry().values() if base == base_role]
+
+# Company details shown on every page (and every payslip / leave letter) are
+# cached as a plain dict so render_template never hits the database.
+COMPANY_INFO_TTL = 300
+DEFAULT_COMPANY = {"name":"HR PRO","address":"Default Address","email":"info@hrpro.com","phone":"+91 9999999999","gstn":""}
+_company_cache = {'loaded_at': None, 'company': None}
+
+def get_company_info():
+    loaded_at = _company_cache['loaded_at']
+    if loaded_at is None or time.monotonic() - loaded_at > COMPANY_INFO_TTL:
         try:
-            db.session.add(Role(name='HR', prefix='HR', base_role='hr'))
-            db.session.add(Role(name='Supervisor', prefix='SUP', base_role='supervisor'))
-            db.session.add(Role(name='Employee', prefix='EMP', base_role='employee'))
-            db.session.commit()
-        except: db.session.rollback()
+            info = CompanyInfo.query.first()
+        except Exception:
+            # Table might not exist yet (run `flask init-db`); don't cache the placeholder
+            db.session.rollback()
+            return DEFAULT_COMPANY
+        company = DEFAULT_COMPANY
+        if info:
+            company = {"name": info.name, "address": info.address, "email": info.email, "phone": info.phone, "gstn": info.gstn or ""}
+        _company_cache['company'] = company
+        _company_cache['loaded_at'] = time.monotonic()
+    return _company_cache['company']
+
+def invalidate_company_info():
+    _company_cache['loaded_at'] = None
 
-    if not info:
-         return dict(company={"name":"HR PRO","address":"Default Address","email":"info@hrpro.com","phone":"+91 9999999999"})
-    
-    return dict(company=info)
+@app.context_processor
+def inject_company_info():
+    return dict(company=get_company_info())
+
+def keyset_page(query):
+    """One page of a User query ordered by employee_id, starting after the
+    ?after=<employee_id> cursor. Returns (rows, next_cursor); next_cursor is
+    None on the last page."""
+    page_size = min(max(request.args.get('page_size', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    after = request.args.get('after')
+    if after:
+        query = query.filter(User.employee_id > after)
+    rows = query.order_by(User.employee_id).limit(page_size + 1).all()
+    next_cursor = rows[page_size - 1].employee_id if len(rows) > page_size else None
+    return rows[:page_size], next_cursor
+
+def wants_json():
+    return request.args.get('format') == 'json'
+
+def employee_json(user):
+    return {'id': user.id, 'employee_id': user.employee_id, 'name': user.name, 'email': user.email,
+            'phone_number': user.phone_number, 'role': user.role, 'supervisor_id': user.supervisor_id}
 
 @app.route('/')
 def index(): return render_template('index.html')
 
+@app.errorhandler(HashingBusy)
+def password_hashing_busy(e):
+    # Login storm or a large import: shed the request rather than queue it behind every other hash
+    if wants_json():
+        return jsonify(error="The server is busy checking passwords; try again in a moment."), 503, {'Retry-After': '5'}
+    flash('The server is busy checking passwords; please try again in a moment.', 'error')
+    return redirect(request.url)
+
 @app.route('/login/<portal_role>', methods=['GET', 'POST'])
 def login_role(portal_role):
     valid_portals = {'hr', 'supervisor', 'employee'}
@@ -181,9 +386,8 @@ def login_role(portal_role):
     
     if current_user.is_authenticated:
         # Check if user's role maps to this portal
-        user_role_obj = Role.query.filter(Role.name.ilike(current_user.role)).first()
         # Fallback: exact match if role not in DB (legacy)
-        base = user_role_obj.base_role if user_role_obj else current_user.role.lower()
+        base = get_base_role(current_user.role) or current_user.role.lower()
         
         if base == portal_role: return redirect(url_for('dashboard'))
         else: logout_user()
@@ -192,11 +396,11 @@ def login_role(portal_role):
         user = User.query.filter_by(employee_id=request.form['employee_id'].upper()).first()
         if user and user.check_password(request.form['password']):
              # Check permission
-             user_role_obj = Role.query.filter(Role.name.ilike(user.role)).first()
-             base = user_role_obj.base_role if user_role_obj else user.role.lower()
+             base = get_base_role(user.role) or user.role.lower()
              
              if base == portal_role:
                  login_user(user)
+                 db.session.commit() # saves a rehashed password
                  return redirect(url_for('dashboard'))
              else:
                  flash(f'Access denied for {portal_role.title()} portal. Your role is {user.role}.', 'error')
@@ -215,19 +419,43 @@ def logout():
     logout_user()
     return redirect(url_for('index'))
 
+def welcome_email(name, email, role, employee_id, password, supervisor=None):
+    """The welcome message with login credentials for a new user; supervisor needs name, email and phone_number."""
+    supervisor_info = ""
+    if supervisor:
+        supervisor_info = f"\n\nReporting Manager:\nName: {supervisor.name}\nEmail: {supervisor.email}\nPhone: {supervisor.phone_number}"
+    msg = Message(f'Welcome to HR Pro Solutions - {name}', recipients=[email])
+    msg.body = f"""Dear {name},
+
+Welcome to the team! Your account has been successfully created.
+
+Here are your login credentials:
+Portal Role: {role}
+Employee ID: {employee_id}
+Password: {password}
+
+Please login at: {url_for('login', _external=True)}
+{supervisor_info}
+
+We are excited to have you on board!
+
+Best Regards,
+HR Team
+            """
+    return msg
+
 @app.route('/register', methods=['GET', 'POST'])
 @login_required
 def register():
+    current_base_role = get_base_role(current_user.role)
     if current_user.role not in ['HR', 'Supervisor', 'hr', 'supervisor']: # simple check, ideally check base_role
         # Better: check base_role
-        ur = Role.query.filter(Role.name.ilike(current_user.role)).first()
-        if not ur or ur.base_role not in ['hr', 'supervisor']:
+        if current_base_role not in ['hr', 'supervisor']:
              flash('You do not have permission to register users.', 'error'); return redirect(url_for('dashboard'))
     
-    supervisors_base = Role.query.filter_by(base_role='supervisor').first() # Get supervisor role name? 
-    # Actually need users who have a supervisor-type role
+    # Need users who have a supervisor-type role
     # Find all roles with base_role='supervisor'
-    sup_roles = [r.name for r in Role.query.filter_by(base_role='supervisor').all()]
+    sup_roles = role_names_with_base('supervisor')
     supervisors = User.query.filter(User.role.in_(sup_roles)).all() if sup_roles else []
     
     # Legacy: also check 'supervisor' string just in case
@@ -249,10 +477,9 @@ def register():
         new_user_role_name = request.form['role']
         
         # Security Check: Supervisors cannot create HR or Supervisor roles
-        ur = Role.query.filter(Role.name.ilike(current_user.role)).first()
-        if ur and ur.base_role == 'supervisor':
-            target_role = Role.query.filter_by(name=new_user_role_name).first()
-            if target_role and target_role.base_role != 'employee':
+        if current_base_role == 'supervisor':
+            target_base_role = get_base_role(new_user_role_name)
+            if target_base_role and target_base_role != 'employee':
                 flash('Supervisors can only register employees.', 'error')
                 return redirect(url_for('register'))
         
@@ -266,9 +493,8 @@ def register():
         
         # Supervisor assignment
         # Logic: If I am supervisor, I am the supervisor. If I am HR, I select supervisor.
-        ur = Role.query.filter(Role.name.ilike(current_user.role)).first()
-        is_supervisor = ur and ur.base_role == 'supervisor'
-        is_hr = ur and ur.base_role == 'hr'
+        is_supervisor = current_base_role == 'supervisor'
+        is_hr = current_base_role == 'hr'
 
         if is_supervisor:
             new_user.supervisor_id = current_user.id
@@ -282,31 +508,10 @@ def register():
         
         # Send Welcome Email
         try:
-            supervisor_info = ""
-            if new_user.supervisor_id:
-                sup = User.query.get(new_user.supervisor_id)
-                if sup:
-                    supervisor_info = f"\n\nReporting Manager:\nName: {sup.name}\nEmail: {sup.email}\nPhone: {sup.phone_number}"
-
-            msg = Message(f'Welcome to HR Pro Solutions - {new_user.name}', recipients=[new_user.email])
-            msg.body = f"""Dear {new_user.name},
-
-Welcome to the team! Your account has been successfully created.
-
-Here are your login credentials:
-Portal Role: {new_user.role}
-Employee ID: {request.form['employee_id']}
-Password: {request.form['password']}
-
-Please login at: {url_for('login', _external=True)}
-{supervisor_info}
-
-We are excited to have you on board!
-
-Best Regards,
-HR Team
-            """
-            mail.send(msg)
+            sup = db.session.get(User, new_user.supervisor_id) if new_user.supervisor_id else None
+            msg = welcome_email(new_user.name, new_user.email, new_user.role, request.form['employee_id'],
+                                request.form['password'], sup)
+            queue_email(msg)
             flash('New user registered and welcome email sent!', 'success')
         except Exception as e:
             print(f"Error sending welcome email: {e}")
@@ -315,12 +520,60 @@ HR Team
         return redirect(url_for('dashboard'))
     return render_template('register.html', supervisors=supervisors, roles=roles)
 
+@app.route('/register/import', methods=['GET', 'POST'])
+@login_required
+def import_users():
+    """Registers every valid row of an uploaded CSV/XLSX sheet at once and reports
+    the rows that were rejected. With dry_run set, only validates. Supervisors
+    import employees into their own team."""
+    base_role = get_base_role(current_user.role) or current_user.role.lower()
+    if base_role not in ('hr', 'supervisor'):
+        flash('You do not have permission to register users.', 'error'); return redirect(url_for('dashboard'))
+    if request.method == 'GET':
+        return render_template('import_users.html')
+
+    upload = request.files.get('file')
+    dry_run = request.form.get('dry_run') == '1'
+    try:
+        if not upload or not upload.filename: raise ImportFileError("Choose a file to import.")
+        rows = read_sheet(upload.stream, upload.filename)
+    except ImportFileError as e:
+        if wants_json(): return jsonify(error=str(e)), 400
+        flash(str(e), 'error'); return redirect(url_for('import_users'))
+
+    valid, errors = validate_rows(db, User, rows, _get_role_registry(), base_role)
+    created = []
+    if valid and not dry_run:
+        try:
+            created = insert_users(db, User, valid, password_hasher,
+                                   importer_id=current_user.id if base_role == 'supervisor' else None)
+            supervisor_ids = {u['supervisor_id'] for u in created if u['supervisor_id']}
+            supervisors = {s.id: s for s in db.session.query(User.id, User.name, User.email, User.phone_number)
+                                                        .filter(User.id.in_(supervisor_ids))}
+            # The users and their welcome emails are committed together
+            queue_email(*(welcome_email(u['name'], u['email'], u['role'], u['employee_id'], u['password'],
+                                        supervisors.get(u['supervisor_id'])) for u in created))
+        except HashingBusy:
+            db.session.rollback()
+            raise # 503 with Retry-After from password_hashing_busy
+        except Exception as e:
+            db.session.rollback()
+            print(f"Bulk import failed: {e}")
+            if wants_json(): return jsonify(error="The import failed; no users were added."), 500
+            flash('The import failed; no users were added.', 'error'); return redirect(url_for('import_users'))
+
+    report = {'rows': len(rows), 'valid': len(valid), 'imported': len(created), 'dry_run': dry_run, 'errors': errors}
+    if wants_json():
+        return jsonify(report)
+    if created:
+        flash(f"Imported {len(created)} users; welcome emails are on their way.", 'success')
+    return render_template('import_users.html', report=report)
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
     # Determine Role Base
-    ur = Role.query.filter(Role.name.ilike(current_user.role)).first()
-    base_role = ur.base_role if ur else current_user.role.lower()
+    base_role = get_base_role(current_user.role) or current_user.role.lower()
 
     if base_role == 'employee':
         leave_requests = LeaveRequest.query.filter_by(user_id=current_user.id).order_by(LeaveRequest.start_date.desc()).all()
@@ -330,14 +583,16 @@ def dashboard():
         team_members = User.query.filter_by(supervisor_id=current_user.id).order_by(User.employee_id).all()
         
         # Pending Request Logic
+        # The template shows request.employee.name for every row, so load it in the same query
+        leaves_query = LeaveRequest.query.options(db.joinedload(LeaveRequest.employee))
         if current_user.employee_id == MAIN_SUPERVISOR_ID:
-            pending_requests = LeaveRequest.query.filter(LeaveRequest.status == 'Pending').order_by(LeaveRequest.start_date.desc()).all()
-            processed_requests = LeaveRequest.query.filter(LeaveRequest.status != 'Pending').order_by(LeaveRequest.start_date.desc()).all()
+            pending_requests = leaves_query.filter(LeaveRequest.status == 'Pending').order_by(LeaveRequest.start_date.desc()).all()
+            processed_requests = leaves_query.filter(LeaveRequest.status != 'Pending').order_by(LeaveRequest.start_date.desc()).limit(PROCESSED_REQUESTS_LIMIT).all()
             total_employees = User.query.count() # Main supervisor might want to see total
         else:
             team_member_ids = [member.id for member in team_members]
-            pending_requests = LeaveRequest.query.filter(LeaveRequest.user_id.in_(team_member_ids), LeaveRequest.status == 'Pending').all()
-            processed_requests = LeaveRequest.query.filter(LeaveRequest.user_id.in_(team_member_ids), LeaveRequest.status != 'Pending').order_by(LeaveRequest.start_date.desc()).all()
+            pending_requests = leaves_query.filter(LeaveRequest.user_id.in_(team_member_ids), LeaveRequest.status == 'Pending').all()
+            processed_requests = leaves_query.filter(LeaveRequest.user_id.in_(team_member_ids), LeaveRequest.status != 'Pending').order_by(LeaveRequest.start_date.desc()).limit(PROCESSED_REQUESTS_LIMIT).all()
             total_employees = len(team_members)
 
         return render_template('supervisor_dashboard.html', pending_requests=pending_requests, processed_requests=processed_requests, 
@@ -348,52 +603,53 @@ def dashboard():
         role_filter = request.args.get('role', '')
         query = User.query
         if search_query:
-            query = query.filter(or_(User.name.ilike(f'%{search_query}%'), User.employee_id.ilike(f'%{search_query}%')))
+            query = query.filter(search_filter(db, User, search_query))
         if role_filter:
             query = query.filter(User.role.ilike(role_filter)) # Changed to ilike for case-insensitive matching
         
-        all_employees = query.order_by(User.employee_id).all()
-        total_employees_count = len(all_employees)
-        
-        role_counts = {}
-        for e in all_employees:
-             r = e.role.capitalize()
-             role_counts[r] = role_counts.get(r, 0) + 1
-             
-        return render_template('hr_dashboard.html', all_employees=all_employees, total_employees=total_employees_count, role_counts=role_counts)
+        role_counts = count_by_role(db, User, query)
+        total_employees_count = sum(role_counts.values())
+        all_employees, next_cursor = keyset_page(query.options(db.joinedload(User.supervisor)))
+
+        if wants_json():
+            return jsonify(employees=[dict(employee_json(e), supervisor=e.supervisor.name if e.supervisor else None) for e in all_employees],
+                           next_cursor=next_cursor, total_employees=total_employees_count, role_counts=role_counts)
+        return render_template('hr_dashboard.html', all_employees=all_employees, total_employees=total_employees_count, role_counts=role_counts, next_cursor=next_cursor)
     
     else: return "<h1>Invalid Role</h1>"
 
+def attendance_query(base_role, search_query=''):
+    """Users whose attendance the caller manages (everybody for HR, the team for a
+    supervisor), narrowed by search_query; None for anybody else."""
+    if base_role == 'hr':
+        query = User.query
+    elif base_role == 'supervisor':
+        query = User.query.filter_by(supervisor_id=current_user.id)
+    else:
+        return None
+    if search_query:
+        query = query.filter(search_filter(db, User, search_query))
+    return query
+
 @app.route('/attendance')
 @login_required
 def attendance():
     today = date.today()
     
     # Permission & Data Fetching
-    ur = Role.query.filter(Role.name.ilike(current_user.role)).first()
-    base_role = ur.base_role if ur else current_user.role.lower()
-
-    employees = []
-    is_hr = False
-    stats = {'present': 0, 'leave': 0, 'cat_leave_counts': {}}
-    
+    base_role = get_base_role(current_user.role) or current_user.role.lower()
     search_query = request.args.get('q', '').strip()
 
-    if base_role == 'hr':
-        is_hr = True
-        query = User.query
-        if search_query:
-            query = query.filter(or_(User.name.ilike(f'%{search_query}%'), User.employee_id.ilike(f'%{search_query}%')))
-        employees = query.order_by(User.employee_id).all()
-        
-    elif base_role == 'supervisor':
-        query = User.query.filter_by(supervisor_id=current_user.id)
-        if search_query:
-            query = query.filter(or_(User.name.ilike(f'%{search_query}%'), User.employee_id.ilike(f'%{search_query}%')))
-        employees = query.order_by(User.employee_id).all()
-    else:
+    query = attendance_query(base_role, search_query)
+    if query is None:
         flash('Attendance access denied.', 'error')
         return redirect(url_for('dashboard'))
+    is_hr = base_role == 'hr'
+
+    # Counters cover everyone in scope, not just this page
+    stats = attendance_stats(db, User, Attendance, query, today)
+
+    employees, next_cursor = keyset_page(query)
 
     # Fetch Attendance Records
     if employees:
@@ -402,21 +658,15 @@ def attendance():
         att_map = {r.user_id: r.status for r in att_records}
         
         for e in employees:
-            status = att_map.get(e.id, 'Present')
-            e.attendance_today = status
-            
-            if status == 'Present':
-                stats['present'] += 1
-            else:
-                stats['leave'] += 1
-                # Category breakdown (for HR usually)
-                r = e.role.capitalize()
-                stats['cat_leave_counts'][r] = stats['cat_leave_counts'].get(r, 0) + 1
+            e.attendance_today = att_map.get(e.id, 'Present')
     else:
-        if not search_query:
+        if not search_query and not wants_json():
              flash('No employees found to manage attendance.', 'warning')
 
-    return render_template('attendance.html', employees=employees, stats=stats, is_hr=is_hr, today=today, search_query=search_query)
+    if wants_json():
+        return jsonify(employees=[dict(employee_json(e), attendance_today=e.attendance_today) for e in employees],
+                       next_cursor=next_cursor, stats=stats, date=today.isoformat())
+    return render_template('attendance.html', employees=employees, stats=stats, is_hr=is_hr, today=today, search_query=search_query, next_cursor=next_cursor)
 
 @app.route('/profile', methods=['GET', 'POST'])
 @login_required
@@ -441,12 +691,10 @@ def edit_user(user_id):
     if current_user.role != 'hr' and user_to_edit.supervisor_id != current_user.id:
         flash('You do not have permission to edit this user.', 'error')
         return redirect(url_for('dashboard'))
-    # Fetch supervisors based on base_role
-    sup_roles = [r.name for r in Role.query.filter_by(base_role='supervisor').all()]
-    supervisors = User.query.filter(User.role.in_(sup_roles)).all() if sup_roles else []
-    
-    # Fallback for legacy data
-    if not supervisors: supervisors = User.query.filter(User.role.ilike('supervisor')).all()
+    # First page of supervisors; the dropdown fetches more from /api/supervisors
+    supervisors, next_cursor = keyset_page(supervisors_query())
+    if user_to_edit.supervisor and user_to_edit.supervisor not in supervisors:
+        supervisors.append(user_to_edit.supervisor)
     if request.method == 'POST':
         user_to_edit.name = request.form['name']
         user_to_edit.email = request.form['email']
@@ -460,10 +708,23 @@ def edit_user(user_id):
                 user_to_edit.supervisor_id = int(supervisor_id)
             else:
                 user_to_edit.supervisor_id = None
+        mark_payroll_dirty(user_to_edit.id)
         db.session.commit()
         flash(f'Details for {user_to_edit.name} have been updated.', 'success')
         return redirect(url_for('dashboard'))
-    return render_template('edit_user.html', user_to_edit=user_to_edit, supervisors=supervisors, roles=Role.query.all())
+    return render_template('edit_user.html', user_to_edit=user_to_edit, supervisors=supervisors, next_cursor=next_cursor, roles=Role.query.all())
+
+def supervisors_query():
+    """Users whose role has base_role 'supervisor' (or the legacy 'supervisor' role string)."""
+    sup_roles = role_names_with_base('supervisor')
+    return User.query.filter(or_(User.role.in_(sup_roles), User.role.ilike('supervisor')))
+
+@app.route('/api/supervisors')
+@login_required
+def api_supervisors():
+    if current_user.role != 'hr': abort(403)
+    supervisors, next_cursor = keyset_page(supervisors_query())
+    return jsonify(supervisors=[employee_json(s) for s in supervisors], next_cursor=next_cursor)
 
 @app.route('/remove_user/<int:user_id>', methods=['POST'])
 @login_required
@@ -471,8 +732,7 @@ def remove_user(user_id):
     user_to_remove = User.query.get_or_404(user_id)
     can_remove = False
     # Determine Role Base
-    ur = Role.query.filter(Role.name.ilike(current_user.role)).first()
-    base_role = ur.base_role if ur else current_user.role.lower()
+    base_role = get_base_role(current_user.role) or current_user.role.lower()
 
     if base_role == 'hr' and user_to_remove.id != current_user.id: can_remove = True
     if base_role == 'supervisor' and user_to_remove.supervisor_id == current_user.id: can_remove = True
@@ -487,12 +747,32 @@ def remove_user(user_id):
     LeaveRequest.query.filter_by(user_id=user_to_remove.id).delete()
     PersonalTask.query.filter_by(user_id=user_to_remove.id).delete()
     PasswordResetOTP.query.filter_by(user_id=user_to_remove.id).delete()
+    # Closed payroll runs keep their lines as history
+    open_runs = db.session.query(PayrollRun.id).filter(PayrollRun.status == 'Open').scalar_subquery()
+    PayrollLine.query.filter(PayrollLine.user_id == user_to_remove.id, PayrollLine.run_id.in_(open_runs)).delete(synchronize_session=False)
     
     db.session.delete(user_to_remove)
     db.session.commit()
     flash(f'User {user_to_remove.name} has been removed.', 'success')
     return redirect(url_for('dashboard'))
 
+ATTENDANCE_STATUSES = ('Present', 'Leave')
+
+def _attendance_leave_email(employee, day):
+    msg = Message(f'Attendance Update: Marked as Leave', recipients=[employee.email])
+    msg.body = f"""Dear {employee.name},
+
+You have been  marked as 'Leave' for {'today ' if day == date.today() else ''}({day.strftime('%Y-%m-%d')}).
+
+Marked by: {current_user.name} ({current_user.role})
+
+ For further information contact your team leader or HR(if necessary only).
+
+Regards,
+HR System
+             """
+    return msg
+
 @app.route('/mark_attendance', methods=['POST'])
 @login_required
 def mark_attendance():
@@ -506,8 +786,7 @@ def mark_attendance():
     is_authorized = False
     
     # Check Role Base
-    ur = Role.query.filter(Role.name.ilike(current_user.role)).first()
-    base_role = ur.base_role if ur else current_user.role.lower()
+    base_role = get_base_role(current_user.role) or current_user.role.lower()
     
     if base_role == 'hr':
         is_authorized = True
@@ -533,19 +812,7 @@ def mark_attendance():
     # Email Notification if marked as Leave
     if status == 'Leave':
         try:
-             msg = Message(f'Attendance Update: Marked as Leave', recipients=[target_user.email])
-             msg.body = f"""Dear {target_user.name},
-
-You have been  marked as 'Leave' for today ({target_date.strftime('%Y-%m-%d')}).
-
-Marked by: {current_user.name} ({current_user.role})
-
- For further information contact your team leader or HR(if necessary only).
-
-Regards,
-HR System
-             """
-             mail.send(msg)
+             queue_email(_attendance_leave_email(target_user, target_date))
              flash(f"Marked {target_user.name} as LEAVE and sent notification email.", 'warning')
         except Exception as e:
             print(f"Email failed: {e}")
@@ -555,6 +822,114 @@ HR System
         
     return redirect(url_for('dashboard'))
 
+def _parse_attendance_entries():
+    """Reads (user_id, status, date) entries from a JSON body {"entries": [...]} or
+    from the attendance sheet form (user_ids plus status_<user_id> fields).
+    Raises ValueError on malformed input."""
+    today = date.today()
+    if request.is_json:
+        raw = (request.get_json(silent=True) or {}).get('entries')
+        if not isinstance(raw, list): raise ValueError('expected {"entries": [...]}')
+    else:
+        raw = [{'user_id': uid, 'status': request.form.get(f'status_{uid}'), 'date': request.form.get('date')}
+               for uid in request.form.getlist('user_ids')]
+    entries = {}
+    for item in raw:
+        if not isinstance(item, dict): raise ValueError('each entry must be an object')
+        try:
+            user_id = int(item.get('user_id'))
+        except (TypeError, ValueError):
+            raise ValueError(f"invalid user_id: {item.get('user_id')!r}")
+        status = item.get('status')
+        if status not in ATTENDANCE_STATUSES: raise ValueError(f'invalid status for user {user_id}: {status!r}')
+        day = datetime.strptime(item['date'], '%Y-%m-%d').date() if item.get('date') else today
+        if day > today: raise ValueError(f'cannot mark attendance for a future date ({day})')
+        entries[(user_id, day)] = status # last entry for a user and day wins
+    return entries
+
+_attendance_index = {'ready': None}
+
+def attendance_index_ready():
+    """True once ux_attendance_user_date exists. create_all makes it for new
+    databases; older ones only get it from migrate-db, and not while duplicate
+    (user_id, date) rows remain."""
+    if not _attendance_index['ready']:
+        _attendance_index['ready'] = db.session.execute(db.text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ux_attendance_user_date'")).first() is not None
+    return _attendance_index['ready']
+
+def upsert_attendance(rows):
+    """Writes {'user_id', 'date', 'status', 'marked_by'} rows, replacing the status
+    of any existing row for the same employee and day. One upsert when the unique
+    index exists; otherwise the existing rows are read with one query and updated,
+    and the rest inserted."""
+    if not rows: return
+    if attendance_index_ready():
+        stmt = sqlite_insert(Attendance)
+        stmt = stmt.on_conflict_do_update(index_elements=['user_id', 'date'],
+                                          set_={'status': stmt.excluded.status, 'marked_by': stmt.excluded.marked_by})
+        db.session.execute(stmt, rows)
+        return
+    # ON CONFLICT has no constraint to match yet
+    by_key = {(row['user_id'], row['date']): row for row in rows}
+    existing = Attendance.query.filter(Attendance.user_id.in_({user_id for user_id, _ in by_key}),
+                                       Attendance.date.in_({day for _, day in by_key}))
+    found = set()
+    for record in existing:
+        row = by_key.get((record.user_id, record.date))
+        if row:
+            record.status, record.marked_by = row['status'], row['marked_by'] # every duplicate, not just one
+            found.add((record.user_id, record.date))
+    missing = [row for key, row in by_key.items() if key not in found]
+    if missing: db.session.execute(db.insert(Attendance), missing)
+
+@app.route('/mark_attendance/bulk', methods=['POST'])
+@login_required
+def mark_attendance_bulk():
+    """Marks many employees at once from the attendance sheet or a JSON body:
+    one authorization query, one upsert and one batch of leave emails."""
+    wants_json_reply = request.is_json
+    def fail(message, code):
+        if wants_json_reply: return jsonify(error=message), code
+        flash(message, 'error'); return redirect(url_for('attendance', **request.args))
+
+    base_role = get_base_role(current_user.role) or current_user.role.lower()
+    if base_role not in ('hr', 'supervisor'): return fail('Permission denied.', 403)
+    try:
+        entries = _parse_attendance_entries()
+    except (TypeError, ValueError) as e:
+        return fail(f'Invalid attendance data: {e}', 400)
+    if not entries:
+        return fail('No attendance entries submitted.', 400)
+
+    user_ids = {user_id for user_id, _ in entries}
+    allowed = User.query.filter(User.id.in_(user_ids))
+    if base_role == 'supervisor': allowed = allowed.filter(User.supervisor_id == current_user.id)
+    employees = {u.id: u for u in allowed}
+    if len(employees) != len(user_ids):
+        return fail('Permission denied for one or more employees.', 403)
+
+    # Only notify people whose status actually changes to Leave, so re-submitting a sheet is quiet
+    days = {day for _, day in entries}
+    previous = {(a.user_id, a.date): a.status for a in Attendance.query.filter(Attendance.user_id.in_(user_ids), Attendance.date.in_(days))}
+
+    notices = [_attendance_leave_email(employees[user_id], day) for (user_id, day), status in entries.items()
+               if status == 'Leave' and previous.get((user_id, day), 'Present') != 'Leave']
+    try:
+        upsert_attendance([{'user_id': user_id, 'date': day, 'status': status, 'marked_by': current_user.id}
+                           for (user_id, day), status in entries.items()])
+        queue_email(*notices) # commits the attendance rows together with the emails
+    except Exception as e:
+        print(f"Email failed: {e}")
+        db.session.rollback()
+        return fail('Attendance could not be saved.', 500)
+
+    leave_count = sum(1 for status in entries.values() if status == 'Leave')
+    if wants_json_reply:
+        return jsonify(marked=len(entries), leave=leave_count, present=len(entries) - leave_count, notified=len(notices))
+    flash(f"Saved attendance for {len(entries)} employees ({leave_count} on leave, {len(notices)} notified).", 'success')
+    return redirect(url_for('attendance', **request.args))
+
 @app.route('/apply_leave', methods=['GET', 'POST'])
 @login_required
 def apply_leave():
@@ -563,6 +938,11 @@ def apply_leave():
         end_date = datetime.strptime(request.form['end_date'], '%Y-%m-%d').date()
         if start_date > end_date:
             flash('End date must be after start date.', 'error'); return redirect(url_for('apply_leave'))
+        overlap = find_overlap(db, LeaveRequest, current_user.id, start_date, end_date)
+        if overlap:
+            flash(f"These dates overlap your {overlap.status.lower()} leave from {overlap.start_date.strftime('%d-%b-%Y')} "
+                  f"to {overlap.end_date.strftime('%d-%b-%Y')}.", 'error')
+            return redirect(url_for('apply_leave'))
         
         # Prepare Leave Letter Content
         rendered_html = render_template('leave_letter.html', 
@@ -596,75 +976,66 @@ def apply_leave():
                  msg = Message(f'Formal Leave Application: {current_user.name}', recipients=[supervisor.email])
                  msg.body = f"Please view the attached leave application from {current_user.name}."
                  msg.html = rendered_html # Send the professional format as HTML email
-                 mail.send(msg)
+                 queue_email(msg)
         except Exception as e:
             print(f"Failed to send email to supervisor: {e}")
 
         return redirect(url_for('dashboard'))
     return render_template('apply_leave.html')
 
-@app.route('/respond_leave/<int:request_id>/<action>')
-@login_required
-def respond_leave(request_id, action):
-    leave_request = LeaveRequest.query.get_or_404(request_id)
-    is_authorized = False
-    if current_user.employee_id == MAIN_SUPERVISOR_ID: is_authorized = True
-    if leave_request.employee.supervisor_id == current_user.id: is_authorized = True
-    if not is_authorized:
-        flash('You do not have permission.', 'error'); return redirect(url_for('dashboard'))
-    if action == 'approve':
-        leave_request.status = 'Approved'; flash(f"Leave for {leave_request.employee.name} approved.", 'success')
-        
-        # Auto-Mark Manual Attendance for approved days
-        # Iterate from start_date to end_date
-        current_date_iter = leave_request.start_date
-        end_date_iter = leave_request.end_date
-        
-        updated_any = False
-        while current_date_iter <= end_date_iter:
-            # Check if record exists
-            existing_att = Attendance.query.filter_by(user_id=leave_request.user_id, date=current_date_iter).first()
-            if not existing_att:
-                new_att = Attendance(user_id=leave_request.user_id, date=current_date_iter, status='Leave', marked_by=current_user.id)
-                db.session.add(new_att)
-                updated_any = True
-            else:
-                # If exists, we force update it to Leave? 
-                # User said "leave aprroved memebrs also can be manually marked as present" -> meaning Manual takes precedence potentially?
-                # But here we are setting initial state. If it was already marked Present manually, do we overwrite?
-                # Usually Approval overwrites. Manual Mark later can change it back.
-                if existing_att.status != 'Leave':
-                     existing_att.status = 'Leave'
-                     existing_att.marked_by = current_user.id
-                     updated_any = True
-            
-            current_date_iter += timedelta(days=1)
-        
-        if updated_any:
+def backfill_leave_attendance(leave_requests):
+    """Marks every business day of the given approved leave requests as 'Leave'
+    (Sundays and public holidays are left alone), reading the existing rows with
+    one query and writing them with upsert_attendance. Returns the ids of the
+    requests whose attendance actually changed."""
+    wanted = {}
+    for leave_request in leave_requests:
+        for day in business_days_between(leave_request.start_date, leave_request.end_date, Holiday):
+            wanted[(leave_request.user_id, day)] = leave_request.id
+    if not wanted: return set()
+
+    user_ids = {user_id for user_id, _ in wanted}
+    existing = db.session.query(Attendance.user_id, Attendance.date, Attendance.status).filter(
+        Attendance.user_id.in_(user_ids),
+        Attendance.date >= min(day for _, day in wanted),
+        Attendance.date <= max(day for _, day in wanted))
+    statuses = {(user_id, day): status for user_id, day, status in existing}
+    # Approval overwrites a manual mark; marking them Present again later is still possible
+    changes = [key for key in wanted if statuses.get(key) != 'Leave']
+    if not changes: return set()
+
+    upsert_attendance([{'user_id': user_id, 'date': day, 'status': 'Leave', 'marked_by': current_user.id}
+                       for user_id, day in changes])
+    return {wanted[key] for key in changes}
+
+def decide_leave_requests(leave_requests, action):
+    """Approves or declines leave requests in the current transaction, backfilling
+    attendance for approvals. Returns the notification emails to queue; the caller commits."""
+    leave_requests = list(leave_requests)
+    if not leave_requests: return []
+    status_msg = "Approved" if action == 'approve' else "Declined"
+    mark_payroll_dirty(start=min(l.start_date for l in leave_requests), end=max(l.end_date for l in leave_requests),
+                       user_ids={l.user_id for l in leave_requests})
+    for leave_request in leave_requests:
+        leave_request.status = status_msg
+    auto_marked = backfill_leave_attendance(leave_requests) if action == 'approve' else set()
+
+    messages = []
+    for leave_request in leave_requests:
+        if leave_request.id in auto_marked:
             # Send Notification "Auto Leave Marked"
-             try:
-                msg_auto = Message(f'Leave Attendance Marked', recipients=[leave_request.employee.email])
-                msg_auto.body = f"""Dear {leave_request.employee.name},
+            msg_auto = Message(f'Leave Attendance Marked', recipients=[leave_request.employee.email])
+            msg_auto.body = f"""Dear {leave_request.employee.name},
 
 Per your approved leave request, your attendance has been automatically marked as 'Leave' for {leave_request.start_date} to {leave_request.end_date}.
 
 Regards,
 HR System
                 """
-                mail.send(msg_auto)
-             except Exception as e:
-                print(f"Auto-mail failed: {e}")
+            messages.append(msg_auto)
 
-    elif action == 'decline':
-        leave_request.status = 'Declined'; flash(f"Leave for {leave_request.employee.name} declined.", 'error')
-    
-    db.session.commit()
-    
-    # Notify Employee (Status Update)
-    try:
-        emp_email = leave_request.employee.email
-        status_msg = "Approved" if action == 'approve' else "Declined"
-        msg = Message(f'Leave Request {status_msg}', recipients=[emp_email])
+        # Notify Employee (Status Update)
+        msg = Message(f'Leave Request {status_msg}', recipients=[leave_request.employee.email])
         msg.body = f"""Dear {leave_request.employee.name},
 
 Your leave request from {leave_request.start_date} to {leave_request.end_date} has been {status_msg}.
@@ -674,18 +1045,118 @@ Checked by: {current_user.name}
 Regards,
 HR Team
         """
-        mail.send(msg)
+        messages.append(msg)
+    return messages
+
+def leave_balance(employee, year):
+    """Working days of leave approved, pending and remaining for an employee in a
+    calendar year. Leaves crossing the year boundary count only their days inside it."""
+    start, end = date(year, 1, 1), date(year, 12, 31)
+    used = {'Approved': 0, 'Pending': 0}
+    for leave_request in leaves_overlapping(db, LeaveRequest, start, end, user_ids=[employee.id]):
+        days = business_days_between(max(leave_request.start_date, start), min(leave_request.end_date, end), Holiday)
+        used[leave_request.status] += len(days)
+    allowance = app.config['ANNUAL_LEAVE_DAYS']
+    return {'employee_id': employee.employee_id, 'name': employee.name, 'year': year, 'allowance': allowance,
+            'approved': used['Approved'], 'pending': used['Pending'], 'remaining': allowance - used['Approved'],
+            'available': allowance - used['Approved'] - used['Pending']}
+
+@app.route('/api/leave_balance', defaults={'user_id': None})
+@app.route('/api/leave_balance/<int:user_id>')
+@login_required
+def api_leave_balance(user_id):
+    """Leave balance for the current user, or for user_id (HR, or that employee's supervisor).
+    Optional ?year=YYYY, default the current year."""
+    employee = current_user if user_id is None else db.get_or_404(User, user_id)
+    if employee.id != current_user.id:
+        base_role = get_base_role(current_user.role) or current_user.role.lower()
+        if base_role != 'hr' and employee.supervisor_id != current_user.id: abort(403)
+    year = request.args.get('year', date.today().year, type=int)
+    if not 1900 <= year <= 9999: abort(400)
+    return jsonify(leave_balance(employee, year))
+
+@app.route('/respond_leave/<int:request_id>/<action>')
+@login_required
+def respond_leave(request_id, action):
+    leave_request = LeaveRequest.query.get_or_404(request_id)
+    is_authorized = False
+    if current_user.employee_id == MAIN_SUPERVISOR_ID: is_authorized = True
+    if leave_request.employee.supervisor_id == current_user.id: is_authorized = True
+    if not is_authorized:
+        flash('You do not have permission.', 'error'); return redirect(url_for('dashboard'))
+    if action not in ('approve', 'decline'):
+        abort(404)
+
+    messages = decide_leave_requests([leave_request], action)
+    try:
+        queue_email(*messages) # commits the decision together with its emails
     except Exception as e:
-         print(f"Failed to send status email to employee: {e}")
+        print(f"Failed to save leave decision: {e}")
+        db.session.rollback()
+        flash('Leave request could not be updated.', 'error'); return redirect(url_for('dashboard'))
+    if action == 'approve': flash(f"Leave for {leave_request.employee.name} approved.", 'success')
+    else: flash(f"Leave for {leave_request.employee.name} declined.", 'error')
 
     return redirect(url_for('dashboard'))
 
+@app.route('/respond_leave/bulk', methods=['POST'])
+@login_required
+def respond_leave_bulk():
+    """Approves or declines a queue of pending leave requests in one transaction.
+    Takes JSON {"action": "approve"|"decline", "request_ids": [...]} or the
+    dashboard form (request_ids checkboxes and an action button)."""
+    wants_json_reply = request.is_json
+    def fail(message, code):
+        if wants_json_reply: return jsonify(error=message), code
+        flash(message, 'error'); return redirect(url_for('dashboard'))
+
+    if wants_json_reply:
+        data = request.get_json(silent=True) or {}
+        action, raw_ids = data.get('action'), data.get('request_ids')
+    else:
+        action, raw_ids = request.form.get('action'), request.form.getlist('request_ids')
+    if action not in ('approve', 'decline'):
+        return fail('Action must be approve or decline.', 400)
+    try:
+        request_ids = {int(i) for i in raw_ids or []}
+    except (TypeError, ValueError):
+        return fail('Invalid leave request ids.', 400)
+    if not request_ids:
+        return fail('No leave requests selected.', 400)
+
+    allowed = LeaveRequest.query.join(User, LeaveRequest.user_id == User.id) \
+                                .options(db.contains_eager(LeaveRequest.employee)) \
+                                .filter(LeaveRequest.id.in_(request_ids))
+    if current_user.employee_id != MAIN_SUPERVISOR_ID:
+        allowed = allowed.filter(User.supervisor_id == current_user.id)
+    leave_requests = allowed.all()
+    if len(leave_requests) != len(request_ids):
+        return fail('You do not have permission for one or more of these leave requests.', 403)
+    already_done = [l.id for l in leave_requests if l.status != 'Pending']
+    if already_done:
+        return fail(f"Leave requests already processed: {', '.join(map(str, sorted(already_done)))}.", 409)
+
+    messages = decide_leave_requests(leave_requests, action)
+    try:
+        queue_email(*messages) # one commit for every decision, attendance row and email
+    except Exception as e:
+        print(f"Bulk leave decision failed: {e}")
+        db.session.rollback()
+        return fail('Leave requests could not be updated.', 500)
+
+    status_msg = "approved" if action == 'approve' else "declined"
+    if wants_json_reply:
+        return jsonify(action=action, processed=sorted(request_ids), notified=len(messages))
+    flash(f"{len(leave_requests)} leave requests {status_msg}.", 'success' if action == 'approve' else 'error')
+    return redirect(url_for('dashboard'))
+
 @app.route('/delete_leave_request/<int:request_id>')
 @login_required
 def delete_leave_request(request_id):
     leave_request = LeaveRequest.query.get_or_404(request_id)
     
     # Delete DB Record
+    mark_payroll_dirty(leave_request.user_id, leave_request.start_date, leave_request.end_date)
     db.session.delete(leave_request)
     db.session.commit()
     
@@ -699,7 +1170,9 @@ def holidays():
         flash('You do not have permission.', 'error'); return redirect(url_for('dashboard'))
     if request.method == 'POST':
         new_holiday = Holiday(date=datetime.strptime(request.form['date'], '%Y-%m-%d').date(), name=request.form['name'], type=request.form.get('type'))
+        mark_payroll_dirty(start=new_holiday.date, end=new_holiday.date)
         db.session.add(new_holiday); db.session.commit()
+        invalidate_month_calendar(new_holiday.date)
         flash('Holiday added!', 'success'); return redirect(url_for('holidays'))
     upcoming_holidays = Holiday.query.filter(Holiday.date >= datetime.today()).order_by(Holiday.date).all()
     return render_template('holidays.html', holidays=upcoming_holidays)
@@ -710,15 +1183,16 @@ def delete_holiday(holiday_id):
     if current_user.role != 'hr':
         flash('You do not have permission.', 'error'); return redirect(url_for('dashboard'))
     holiday = Holiday.query.get_or_404(holiday_id)
+    mark_payroll_dirty(start=holiday.date, end=holiday.date)
     db.session.delete(holiday); db.session.commit()
+    invalidate_month_calendar(holiday.date)
     flash('Holiday deleted.', 'success'); return redirect(url_for('holidays'))
 
 @app.route('/roles', methods=['GET', 'POST'])
 @login_required
 def roles():
     # Check permission (HR Only?)
-    ur = Role.query.filter(Role.name.ilike(current_user.role)).first()
-    is_hr = ur and ur.base_role == 'hr'
+    is_hr = get_base_role(current_user.role) == 'hr'
     if not is_hr:
         flash('You do not have permission.', 'error'); return redirect(url_for('dashboard'))
         
@@ -727,12 +1201,13 @@ def roles():
             role_to_delete = db.session.get(Role, request.form['delete_id'])
             # Don't delete seeded roles? Or allow.
             if role_to_delete: 
-                db.session.delete(role_to_delete); db.session.commit(); flash('Role removed.', 'success')
+                db.session.delete(role_to_delete); db.session.commit(); invalidate_role_registry(); flash('Role removed.', 'success')
         else:
             # Handle duplicates
             try:
                 new_role = Role(name=request.form['name'], prefix=request.form['prefix'], base_role=request.form.get('base_role', 'employee'))
                 db.session.add(new_role); db.session.commit()
+                invalidate_role_registry()
                 flash('Role added!', 'success')
             except Exception as e:
                 db.session.rollback()
@@ -741,129 +1216,211 @@ def roles():
     all_roles = Role.query.all()
     return render_template('roles.html', roles=all_roles)
 
+# Payroll snapshots: every month that has been viewed gets a PayrollRun whose
+# lines are reused until something they depend on changes (mark_payroll_dirty).
+# `flask run-payroll` closes a month, after which its lines are never recomputed.
+# Snapshot writes made while serving a page go through their own connection so
+# they never expire the objects the calling route has already loaded.
+def _get_or_create_payroll_run(year, month):
+    period_start = date(year, month, 1)
+    run = PayrollRun.query.filter_by(period_start=period_start).first()
+    if run: return run
+    with db.engine.begin() as conn:
+        conn.execute(sqlite_insert(PayrollRun).values(
+            period_start=period_start, period_end=date(year, month, monthrange(year, month)[1]),
+            status='Open', created_at=datetime.utcnow()
+        ).on_conflict_do_nothing(index_elements=['period_start']))
+    return PayrollRun.query.filter_by(period_start=period_start).one()
+
+def _payslip_from_line(line, month_year):
+    payslip = {
+        "employee_name": line.employee_name,
+        "month_year": month_year,
+        "gross_salary": line.gross_salary,
+        "total_payable_days": line.total_payable_days,
+        "per_day_salary": line.per_day_salary,
+        "deductible_leave_days": line.deductible_leave_days,
+        "deductions": line.deductions,
+        "net_salary": line.net_salary
+    }
+    if line.error: payslip['error'] = line.error
+    else: payslip['leave_dates'] = line.leave_dates.split(',') if line.leave_dates else []
+    return payslip
+
+def _save_payroll_lines(conn, run, employees, payslips, seen_dirty=None):
+    """Upserts computed lines. seen_dirty maps user_id to the dirty count read
+    before computing; an existing line is only overwritten (and marked clean) if
+    its count is unchanged, otherwise it stays dirty for the next read."""
+    if not employees: return
+    seen_dirty = seen_dirty or {}
+    stmt = sqlite_insert(PayrollLine)
+    columns = ['employee_name', 'gross_salary', 'total_payable_days', 'per_day_salary', 'deductible_leave_days',
+               'leave_dates', 'deductions', 'net_salary', 'error']
+    # The inserted dirty value carries the count that was read; a new line has none to compare
+    stmt = stmt.on_conflict_do_update(index_elements=['run_id', 'user_id'],
+                                      set_={**{c: stmt.excluded[c] for c in columns}, 'dirty': 0},
+                                      where=PayrollLine.dirty == stmt.excluded.dirty)
+    conn.execute(stmt, [{
+        'run_id': run.id, 'user_id': employee.id,
+        'employee_name': p['employee_name'], 'gross_salary': p['gross_salary'],
+        'total_payable_days': p['total_payable_days'], 'per_day_salary': p['per_day_salary'],
+        'deductible_leave_days': p['deductible_leave_days'], 'leave_dates': ','.join(p.get('leave_dates', [])),
+        'deductions': p['deductions'], 'net_salary': p['net_salary'], 'error': p.get('error'),
+        'dirty': seen_dirty.get(employee.id, 0)
+    } for employee, p in zip(employees, payslips)])
+
+def amount_in_words(amount):
+    """Net pay spelled out for payslips, e.g. 'Twelve Thousand Rupees'."""
+    from num2words import num2words # loads every language on import, so only when a payslip is rendered
+    return num2words(amount, lang='en_IN').title().replace(',', '') + " Rupees"
+
+def get_month_payslips(employees, year, month):
+    """Payslips for a month, read from its PayrollRun. Only employees with no line
+    yet or a dirty line are recomputed; a closed run is returned as frozen (an
+    employee missing from it is computed once and added).
+    Call it before making any changes in the current session."""
+    employees = list(employees)
+    run = _get_or_create_payroll_run(year, month)
+    month_year = run.period_start.strftime("%B %Y")
+    lines = {line.user_id: line for line in PayrollLine.query.filter(PayrollLine.run_id == run.id, PayrollLine.user_id.in_([e.id for e in employees]))}
+    is_open = run.status == 'Open'
+
+    stale = [e for e in employees if e.id not in lines or (is_open and lines[e.id].dirty)]
+    # Another worker may have changed a holiday this process still has cached
+    if stale: invalidate_month_calendar(run.period_start)
+    fresh = dict(zip((e.id for e in stale), calculate_payslips(stale, year, month, db, Holiday, LeaveRequest)))
+    if stale:
+        with db.engine.begin() as conn:
+            _save_payroll_lines(conn, run, stale, [fresh[e.id] for e in stale],
+                                {e.id: lines[e.id].dirty for e in stale if e.id in lines})
+    return [fresh[e.id] if e.id in fresh else _payslip_from_line(lines[e.id], month_year) for e in employees]
+
+def refresh_payroll_lines(query, year, month):
+    """Brings the month's payroll lines up to date for every user matched by query,
+    loading only those with no line or a dirty one. Returns the PayrollRun."""
+    run = _get_or_create_payroll_run(year, month)
+    stale = query.outerjoin(PayrollLine, db.and_(PayrollLine.user_id == User.id, PayrollLine.run_id == run.id))
+    stale_filter = PayrollLine.id.is_(None)
+    if run.status == 'Open': stale_filter = db.or_(stale_filter, PayrollLine.dirty > 0)
+    employees = stale.filter(stale_filter).all()
+    if employees: get_month_payslips(employees, year, month)
+    return run
+
+def mark_payroll_dirty(user_id=None, start=None, end=None, user_ids=None):
+    """Flags lines of open payroll runs overlapping start..end (and for user_id or
+    user_ids, if given) so they are recomputed on next read. Call before committing the change."""
+    runs = db.session.query(PayrollRun.id).filter(PayrollRun.status == 'Open')
+    if start: runs = runs.filter(PayrollRun.period_end >= start)
+    if end: runs = runs.filter(PayrollRun.period_start <= end)
+    lines = PayrollLine.query.filter(PayrollLine.run_id.in_(runs.scalar_subquery()))
+    if user_id: lines = lines.filter(PayrollLine.user_id == user_id)
+    if user_ids is not None: lines = lines.filter(PayrollLine.user_id.in_(user_ids))
+    lines.update({'dirty': PayrollLine.dirty + 1}, synchronize_session=False)
+
 @app.route('/payslip')
 @login_required
 def view_payslip():
     today = datetime.today()
-    payslip_data = calculate_payslip(current_user, today.year, today.month, db, Holiday, LeaveRequest)
+    payslip_data = get_month_payslips([current_user], today.year, today.month)[0]
     return render_template('payslip.html', payslip=payslip_data)
 
-@app.route('/payroll_report')
-@login_required
-def payroll_report():
-    if current_user.role not in ['hr', 'supervisor']:
-        flash('You do not have permission.', 'error'); return redirect(url_for('dashboard'))
-    today = datetime.today()
-    search_query = request.args.get('search', '')
-    role_filter = request.args.get('role', '')
-    view_type = request.args.get('view_type', 'month')
-    
-    selected_month = request.args.get('selected_month')
-    selected_week = request.args.get('selected_week')
-    selected_date = request.args.get('selected_date')
-
-    today = datetime.today()
-    target_date = today
+PERIOD_LABELS = {'month': "Monthly Salary", 'week': "Weekly Salary", 'day': "Daily Salary"}
 
-    # Determine target date/month
-    if view_type == 'month' and selected_month:
+def payroll_period(args):
+    """(view_type, start, end) for the payroll views from view_type and
+    selected_month (YYYY-MM), selected_week (ISO YYYY-Www) or selected_date
+    (YYYY-MM-DD). Missing, invalid or future selections fall back to the period
+    containing today."""
+    today = date.today()
+    view_type = args.get('view_type', 'month')
+    if view_type == 'week':
         try:
-            target_date = datetime.strptime(selected_month, '%Y-%m')
-        except:
-             pass 
-    elif view_type == 'week' and selected_week:
+            year, week_num = map(int, args.get('selected_week', '').split('-W'))
+            start = date.fromisocalendar(year, week_num, 1)
+        except ValueError:
+            start = None
+        if start is None or start > today:
+            start = today - timedelta(days=today.weekday())
+        return view_type, start, start + timedelta(days=6)
+    if view_type == 'day':
         try:
-            # Parse ISO week
-            year, week_num = map(int, selected_week.split('-W'))
-            target_date = datetime.strptime(f'{year}-W{week_num}-1', "%Y-W%W-%w")
-        except:
-             pass
-    elif view_type == 'day' and selected_date:
-        try: 
-             target_date = datetime.strptime(selected_date, '%Y-%m-%d')
-        except:
-             pass
-    
-    # Validation: Ensure not future (simple check)
-    if target_date > datetime.today():
-         # If future, clamp to today? Or handle logic inside. 
-         # For simplicity, if month is future, fallback to current or clamp.
-         # Actually prompt said "upto current only", assuming UI handles it or we clamp.
-         if target_date.year > today.year or (target_date.year == today.year and target_date.month > today.month):
-             target_date = today
+            day = datetime.strptime(args.get('selected_date', ''), '%Y-%m-%d').date()
+        except ValueError:
+            day = None
+        if day is None or day > today: day = today
+        return view_type, day, day
+    try:
+        start = datetime.strptime(args.get('selected_month', ''), '%Y-%m').date()
+    except ValueError:
+        start = None
+    if start is None or start > today:
+        start = today.replace(day=1)
+    return 'month', start, date(start.year, start.month, monthrange(start.year, start.month)[1])
+
+def period_payslips(employees, view_type, start, end):
+    """Payslips for a payroll view: month views come from the payroll snapshots,
+    weeks and days from the period engine."""
+    if view_type == 'month':
+        return get_month_payslips(employees, start.year, start.month)
+    return calculate_period_payslips(employees, start, end, db, Holiday, LeaveRequest)
 
+def period_payroll_totals(query, view_type, start, end):
+    """Payroll totals and net salary per role for every user matched by query."""
+    if view_type == 'month':
+        run = refresh_payroll_lines(query, start.year, start.month)
+        return payroll_totals(db, User, PayrollLine, run.id, query)
+    # Only the columns the period engine needs, not whole User objects
+    rows = query.with_entities(User.id, User.name, User.salary, User.role).all()
+    return sum_payslips(rows, calculate_period_payslips(rows, start, end, db, Holiday, LeaveRequest))
+
+def payroll_report_query(args):
+    """Users on the payroll report, narrowed by the search and role arguments."""
     query = User.query
     # Supervisors should not see HR salaries as HR is a higher role
     if current_user.role == 'supervisor':
         query = query.filter(User.role != 'hr')
-    
-    if search_query:
-        query = query.filter(or_(User.name.ilike(f'%{search_query}%'), User.employee_id.ilike(f'%{search_query}%')))
-    if role_filter:
-        query = query.filter(User.role == role_filter)
-    employees = query.order_by(User.employee_id).all()
+    if args.get('search'):
+        query = query.filter(search_filter(db, User, args['search']))
+    if args.get('role'):
+        query = query.filter(User.role == args['role'])
+    return query
+
+@app.route('/payroll_report')
+@login_required
+def payroll_report():
+    if current_user.role not in ['hr', 'supervisor']:
+        flash('You do not have permission.', 'error'); return redirect(url_for('dashboard'))
+    view_type, period_start, period_end = payroll_period(request.args)
+    query = payroll_report_query(request.args)
+    employees, next_cursor = keyset_page(query)
     
     payroll_data = []
-    
-    if view_type == 'month':
-        month_year = target_date.strftime("%B %Y")
-    elif view_type == 'week':
-        # Show Week info
-        month_year = f"Week {target_date.strftime('%W, %Y')}" 
-    else:
-         month_year = target_date.strftime("%d %B %Y")
+    month_year = period_label(period_start, period_end)
+    if view_type == 'week':
+        month_year = f"Week {period_start.isocalendar()[1]}, {period_start.isocalendar()[0]} ({month_year})"
 
-    total_gross = 0
-    total_deductions = 0
-    total_net = 0
-    
-    # Data for charts
-    role_salary = {}
+    # Totals and chart data cover every matching employee, not just this page
+    totals = period_payroll_totals(query, view_type, period_start, period_end)
+    total_gross, total_deductions, total_net = totals['total_gross'], totals['total_deductions'], totals['total_net']
+    role_salary = totals['role_salary']
 
-    for employee in employees:
-        # Calculate payslip based on selected period's month
-        # Note: 'calculate_payslip' is monthly. For specific weeks, we estimate based on that month's data.
-        payslip = calculate_payslip(employee, target_date.year, target_date.month, db, Holiday, LeaveRequest)
+    payslips = period_payslips(employees, view_type, period_start, period_end)
+    for employee, payslip in zip(employees, payslips):
         payslip['employee_id'] = employee.employee_id
         payslip['user_id'] = employee.id
-        
-        # Adjust based on view_type
-        if view_type == 'week':
-            payslip['gross_salary'] /= 4
-            payslip['deductions'] /= 4
-            payslip['net_salary'] /= 4
-            payslip['period_label'] = "Weekly Estimate"
-        elif view_type == 'day':
-            # Use per_day_salary as calculated in payslip
-            payslip['gross_salary'] = payslip['per_day_salary']
-            if payslip['total_payable_days'] > 0:
-                payslip['deductions'] = payslip['deductions'] / payslip['total_payable_days'] # Average daily deduction
-            else:
-                payslip['deductions'] = 0
-            payslip['net_salary'] = payslip['gross_salary'] - payslip['deductions']
-            payslip['period_label'] = "Daily Rate"
-        else:
-            payslip['period_label'] = "Monthly Salary"
-
+        payslip['period_label'] = PERIOD_LABELS[view_type]
         payroll_data.append(payslip)
-        
-        # Accumulate totals
-        total_gross += payslip['gross_salary']
-        total_deductions += payslip['deductions']
-        total_net += payslip['net_salary']
-        
-        # Accumulate chart data (Salary by Role)
-        r = employee.role.capitalize()
-        role_salary[r] = role_salary.get(r, 0) + payslip['net_salary']
 
     # New counts for UI
-    total_employees = len(employees)
-    role_counts = {}
-    for e in employees:
-        r = e.role.capitalize()
-        role_counts[r] = role_counts.get(r, 0) + 1
+    role_counts = count_by_role(db, User, query)
+    total_employees = sum(role_counts.values())
 
+    if wants_json():
+        return jsonify(payroll_data=payroll_data, next_cursor=next_cursor, month_year=month_year, view_type=view_type,
+                       total_gross=total_gross, total_deductions=total_deductions, total_net=total_net,
+                       role_salary=role_salary, total_employees=total_employees, role_counts=role_counts)
     return render_template('payroll_report.html', 
+                           next_cursor=next_cursor,
                            payroll_data=payroll_data, 
                            month_year=month_year, 
                            view_type=view_type,
@@ -874,7 +1431,7 @@ def payroll_report():
                            total_employees=total_employees,
                            role_counts=role_counts,
                            current_date=datetime.today().strftime('%Y-%m-%d'),
-                           current_week=datetime.today().strftime('%Y-W%W'))
+                           current_week=datetime.today().strftime('%G-W%V'))
 
 @app.route('/download_payslip/<int:user_id>')
 @login_required
@@ -886,40 +1443,98 @@ def download_payslip(user_id):
     today = datetime.today()
     
     # Calculate payslip data (always monthly for the official slip)
-    payslip = calculate_payslip(user, today.year, today.month, db, Holiday, LeaveRequest)
+    payslip = get_month_payslips([user], today.year, today.month)[0]
     payslip['employee_id'] = user.employee_id
     
     # Convert net pay to words
-    net_pay_words = num2words(payslip['net_salary'], lang='en_IN').title().replace(',', '') + " Rupees"
-
-    rendered_html = render_template('payslip_pdf.html', 
-                                    payslip=payslip, 
-                                    role=user.role,
-                                    date_today=today.strftime('%d-%b-%Y'),
-                                    net_pay_words=net_pay_words)
+    net_pay_words = amount_in_words(payslip['net_salary'])
+
+    date_today = today.strftime('%d-%b-%Y')
+    render_html = partial(render_template, 'payslip_pdf.html', 
+                          payslip=payslip, 
+                          role=user.role,
+                          date_today=date_today,
+                          net_pay_words=net_pay_words)
     
     pdf_filename = f"Payslip_{user.employee_id}_{today.strftime('%b_%Y')}.pdf"
     
-    # Generate PDF in memory/temp and stream it? Or just return response
-    # For simplicity and speed, we render to a BytesIO object or just return as response
-    from io import BytesIO
-    from flask import make_response
-    # IMPORTANT: 'HTML' needs weasyprint. If missing, this will fail. Rolling back code means restoring this risk.
-    # Assuming user has weasyprint or wants the code back regardless.
-    try:
-        from weasyprint import HTML
-        pdf_file = BytesIO()
-        HTML(string=rendered_html).write_pdf(pdf_file)
-        pdf_file.seek(0)
-        
-        response = make_response(pdf_file.read())
-        response.headers['Content-Type'] = 'application/pdf'
-        response.headers['Content-Disposition'] = f'attachment; filename={pdf_filename}'
-        return response
-    except ImportError:
+    if not weasyprint_available():
          # Fallback to Browser Print if WeasyPrint is missing (Common on shared hosting)
          # We just return the rendered HTML directly. The template should have print styles.
-         return rendered_html
+         return render_html()
+
+    key = payslip_cache_key(user, payslip, date_today)
+    pdf = payslip_cache.get(key)
+    if pdf is None:
+        pdf = html_to_pdf(render_html())
+        payslip_cache.put(key, pdf)
+
+    from flask import make_response
+    response = make_response(pdf)
+    response.headers['Content-Type'] = 'application/pdf'
+    response.headers['Content-Disposition'] = f'attachment; filename={pdf_filename}'
+    return response
+
+@app.route('/payslip_cache/stats')
+@login_required
+def payslip_cache_stats():
+    if current_user.role != 'hr': abort(403)
+    return jsonify(payslip_cache.stats())
+
+@app.route('/api/employees/search')
+@login_required
+def api_employee_search():
+    """Autocomplete for the employee search boxes: ?q=<text>[&limit=N]."""
+    base_role = get_base_role(current_user.role) or current_user.role.lower()
+    if base_role == 'hr': query = User.query
+    elif base_role == 'supervisor': query = User.query.filter_by(supervisor_id=current_user.id)
+    else: abort(403)
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    matches = autocomplete(db, User, query, request.args.get('q', ''), limit)
+    return jsonify(results=[{'id': u.id, 'employee_id': u.employee_id, 'name': u.name, 'role': u.role} for u in matches])
+
+@app.route('/api/stats')
+@login_required
+def api_stats():
+    """Headcount, attendance and payroll counters for the caller's scope:
+    everybody for HR; the team (attendance) and non-HR staff (payroll) for a supervisor.
+    The payroll block is only sent to the users the payroll report is open to.
+    Optional ?date=YYYY-MM-DD for attendance, and the payroll report's period
+    parameters (view_type with selected_month, selected_week or selected_date)."""
+    base_role = get_base_role(current_user.role) or current_user.role.lower()
+    if base_role not in ('hr', 'supervisor'): abort(403)
+    try:
+        day = datetime.strptime(request.args['date'], '%Y-%m-%d').date() if request.args.get('date') else date.today()
+    except ValueError:
+        abort(400)
+    if request.args.get('view_type', 'month') not in PERIOD_LABELS: abort(400)
+    view_type, period_start, period_end = payroll_period(request.args)
+
+    people = User.query if base_role == 'hr' else User.query.filter_by(supervisor_id=current_user.id)
+    counts = count_by_role(db, User, people)
+    stats = dict(
+        total_employees=sum(counts.values()),
+        role_counts=counts,
+        attendance=dict(attendance_stats(db, User, Attendance, people, day), date=day.isoformat()),
+    )
+    # Same check as payroll_report: custom roles share the base role's team view, not its payroll access
+    if current_user.role in ['hr', 'supervisor']:
+        payroll_scope = User.query if current_user.role == 'hr' else User.query.filter(User.role != 'hr')
+        stats['payroll'] = dict(period_payroll_totals(payroll_scope, view_type, period_start, period_end), view_type=view_type,
+                                start=period_start.isoformat(), end=period_end.isoformat())
+    return jsonify(**stats)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of this process's request metrics, for HR users
+    or a scraper presenting `Authorization: Bearer <METRICS_TOKEN>`."""
+    if request_metrics is None: abort(404)
+    token = app.config['METRICS_TOKEN']
+    bearer = request.headers.get('Authorization', '')
+    if not (token and hmac.compare_digest(bearer, f'Bearer {token}')):
+        if not current_user.is_authenticated: return login_manager.unauthorized()
+        if current_user.role != 'hr': abort(403)
+    return app.response_class(request_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/download_all_payslips')
 @login_required
@@ -928,8 +1543,8 @@ def download_all_payslips():
         flash('You do not have permission.', 'error'); return redirect(url_for('dashboard'))
 
     role_filter = request.args.get('role', '')
-    view_type = request.args.get('view_type', 'month')
-    today = datetime.today()
+    view_type, period_start, period_end = payroll_period(request.args)
+    date_today = datetime.today().strftime('%d-%b-%Y')
 
     query = User.query
     if current_user.role == 'supervisor':
@@ -939,50 +1554,100 @@ def download_all_payslips():
     
     employees = query.order_by(User.employee_id).all()
     
-    from io import BytesIO
-    try:
-        from weasyprint import HTML
-    except ImportError:
-        flash("PDF generation library (WeasyPrint) missing.", "error")
-        return redirect(url_for('payroll_report'))
-
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for employee in employees:
-            # Calculate payslip
-            payslip = calculate_payslip(employee, today.year, today.month, db, Holiday, LeaveRequest)
+    payslips = period_payslips(employees, view_type, period_start, period_end)
+
+    def payslip_documents():
+        # Rendered lazily so only the payslips currently being converted are in memory
+        for employee, payslip in zip(employees, payslips):
             payslip['employee_id'] = employee.employee_id
+            payslip['period_label'] = PERIOD_LABELS[view_type]
             
-            # Adjust based on view_type (Apply same logic as report)
-            if view_type == 'week':
-                payslip['gross_salary'] /= 4; payslip['deductions'] /= 4; payslip['net_salary'] /= 4
-                period_label = "Weekly Estimate"
-            elif view_type == 'day':
-                payslip['gross_salary'] = payslip['per_day_salary']
-                if payslip['total_payable_days'] > 0: payslip['deductions'] = payslip['deductions'] / payslip['total_payable_days']
-                else: payslip['deductions'] = 0
-                payslip['net_salary'] = payslip['gross_salary'] - payslip['deductions']
-                period_label = "Daily Rate"
-            else:
-                period_label = "Monthly Salary"
-            
-            payslip['period_label'] = period_label 
-            
-            # Generate PDF
-            net_pay_words = num2words(payslip['net_salary'], lang='en_IN').title().replace(',', '') + " Rupees"
-            rendered_html = render_template('payslip_pdf.html', payslip=payslip, role=employee.role, date_today=today.strftime('%d-%b-%Y'), net_pay_words=net_pay_words)
-            
-            pdf_io = BytesIO()
-            HTML(string=rendered_html).write_pdf(pdf_io)
-            
-            filename = f"{employee.employee_id}_{employee.name.replace(' ', '_')}_{view_type}.pdf"
-            zip_file.writestr(filename, pdf_io.getvalue())
-            
-    zip_buffer.seek(0)
-    filename = f"Payslips_{view_type}_{today.strftime('%b_%Y')}.zip"
-    
-    from flask import send_file
-    return send_file(zip_buffer, mimetype='application/zip', as_attachment=True, download_name=filename)
+            net_pay_words = amount_in_words(payslip['net_salary'])
+            render_html = partial(render_template, 'payslip_pdf.html', payslip=payslip, role=employee.role, date_today=date_today, net_pay_words=net_pay_words)
+            yield f"{employee.employee_id}_{employee.name.replace(' ', '_')}_{view_type}", payslip_cache_key(employee, payslip, date_today), render_html
+
+    if weasyprint_available():
+        entries = ((name + '.pdf', pdf) for name, pdf in render_pdfs(payslip_documents(), app.config['PDF_WORKERS'], payslip_cache))
+    else:
+        # Fallback if WeasyPrint is missing (Common on shared hosting): printable HTML payslips
+        entries = ((name + '.html', render_html().encode('utf-8')) for name, _, render_html in payslip_documents())
+
+    filename = f"Payslips_{view_type}_{period_start.strftime('%b_%Y' if view_type == 'month' else '%d_%b_%Y')}.zip"
+    response = app.response_class(stream_with_context(stream_zip(entries)), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+def export_response(fmt, filename, title, header, rows, column_widths=None):
+    """Streams rows as a CSV or XLSX attachment named filename.fmt."""
+    response = app.response_class(stream_with_context(export_stream(fmt, title, header, rows, column_widths)),
+                                  content_type=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}.{fmt}'
+    return response
+
+PAYROLL_EXPORT_COLUMNS = ['Employee ID', 'Name', 'Role', 'Period', 'Gross Salary', 'Payable Days', 'Per Day Salary',
+                          'Leave Days', 'Deductions', 'Net Salary', 'Leave Dates', 'Note']
+
+@app.route('/payroll_report/export/<fmt>')
+@login_required
+def export_payroll(fmt):
+    """Every row of the payroll report for the selected period, search and role, as CSV or XLSX."""
+    if fmt not in EXPORT_FORMATS: abort(404)
+    if current_user.role not in ['hr', 'supervisor']:
+        flash('You do not have permission.', 'error'); return redirect(url_for('dashboard'))
+    view_type, period_start, period_end = payroll_period(request.args)
+    # Plain rows rather than User objects; the payroll functions only need these columns
+    query = payroll_report_query(request.args).with_entities(User.id, User.employee_id, User.name, User.role, User.salary)
+
+    def rows():
+        for batch in keyset_batches(query, User.employee_id):
+            for employee, p in zip(batch, period_payslips(batch, view_type, period_start, period_end)):
+                yield (employee.employee_id, employee.name, employee.role.capitalize(), p['month_year'],
+                       round(p['gross_salary'], 2), p['total_payable_days'], round(p['per_day_salary'], 2),
+                       p['deductible_leave_days'], round(p['deductions'], 2), round(p['net_salary'], 2),
+                       ', '.join(p.get('leave_dates', [])), p.get('error', ''))
+
+    return export_response(fmt, f"Payroll_{view_type}_{period_start.isoformat()}", f"Payroll {period_start.isoformat()}",
+                           PAYROLL_EXPORT_COLUMNS, rows(), [14, 28, 12, 22, 14, 13, 14, 11, 13, 14, 40, 30])
+
+@app.route('/attendance/export/<fmt>')
+@login_required
+def export_attendance(fmt):
+    """Attendance matrix for a month (?month=YYYY-MM, default this month): one row per
+    employee, one column per day. P present (also when not marked, as on the
+    attendance page), L leave, S Sunday, H holiday, blank for days still to come."""
+    if fmt not in EXPORT_FORMATS: abort(404)
+    base_role = get_base_role(current_user.role) or current_user.role.lower()
+    query = attendance_query(base_role, request.args.get('q', '').strip())
+    if query is None:
+        flash('Attendance access denied.', 'error')
+        return redirect(url_for('dashboard'))
+    today = date.today()
+    try:
+        month_start = datetime.strptime(request.args.get('month', ''), '%Y-%m').date()
+    except ValueError:
+        month_start = None
+    if month_start is None or month_start > today:
+        month_start = today.replace(day=1)
+
+    calendar = get_month_calendar(month_start.year, month_start.month, Holiday)
+    days = [calendar.start + timedelta(days=i) for i in range(calendar.days)]
+    defaults = ['' if day > today else 'S' if calendar.weekdays[i] == 6 else 'H' if day in calendar.holidays else 'P'
+                for i, day in enumerate(days)]
+    query = query.with_entities(User.id, User.employee_id, User.name, User.role)
+
+    def rows():
+        for batch in keyset_batches(query, User.employee_id):
+            marked = db.session.query(Attendance.user_id, Attendance.date, Attendance.status).filter(
+                Attendance.user_id.in_([e.id for e in batch]), Attendance.date >= calendar.start, Attendance.date <= calendar.end)
+            statuses = {(user_id, day): status for user_id, day, status in marked}
+            for employee in batch:
+                cells = [statuses[(employee.id, day)][:1] if (employee.id, day) in statuses else default
+                         for day, default in zip(days, defaults)]
+                yield (employee.employee_id, employee.name, employee.role.capitalize(), *cells, cells.count('P'), cells.count('L'))
+
+    header = ['Employee ID', 'Name', 'Role', *(day.strftime('%d %a') for day in days), 'Present', 'Leave']
+    return export_response(fmt, f"Attendance_{month_start.strftime('%Y-%m')}", f"Attendance {month_start.strftime('%b %Y')}",
+                           header, rows(), [14, 28, 12] + [7] * len(days) + [9, 9])
 
 @app.route('/calendar')
 @login_required
@@ -996,6 +1661,17 @@ def add_task():
     flash('Task added!', 'success'); return redirect(url_for('view_calendar'))
 
 
+def _events_fingerprint(*queries):
+    """Digest of the columns each event source renders, read as plain tuples.
+    Ids alone are not enough: SQLite hands a deleted newest row's id to the next
+    insert, and a rename keeps the id, so the content itself goes into the ETag."""
+    digest = hashlib.sha1()
+    for query, columns in queries:
+        for row in query.with_entities(*columns).order_by(columns[0]):
+            digest.update(repr(tuple(row)).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
 @app.route('/api/events')
 @login_required
 def api_events():
@@ -1005,49 +1681,191 @@ def api_events():
     try:
         start_date = datetime.strptime(start, '%Y-%m-%d').date()
         end_date = datetime.strptime(end, '%Y-%m-%d').date()
-        current_date = start_date
-        while current_date <= end_date:
-            if current_date.weekday() == 6:
-                events.append({
-                    'title': 'Sunday Holiday', 'start': current_date.isoformat(), 'allDay': True,
-                    'backgroundColor': '#ffe5e5', 'borderColor': '#ffe5e5', 'display': 'background'
-                })
-            current_date += timedelta(days=1)
-    except (ValueError, TypeError): pass
-
-    holidays = Holiday.query.all()
-    for h in holidays:
-        event_data = {'title': h.name, 'start': h.date.isoformat(), 'allDay': True}
-        if h.type == 'company_event':
-            event_data['backgroundColor'] = '#D90429'; event_data['borderColor'] = '#D90429'
-        else:
-            event_data['display'] = 'list-item'; event_data['backgroundColor'] = '#e76f51'; event_data['borderColor'] = '#e76f51'
-        events.append(event_data)
-    
-    
+    except (ValueError, TypeError):
+        start_date = end_date = None
+
+    holidays_query = Holiday.query
     leaves_query = LeaveRequest.query.filter_by(status='Approved')
     if current_user.role == 'hr' or current_user.employee_id == MAIN_SUPERVISOR_ID:
-        leaves = leaves_query.all()
+        pass
     elif current_user.role == 'supervisor':
-        team_member_ids = [member.id for member in current_user.employees]
-        team_member_ids.append(current_user.id) 
-        leaves = leaves_query.filter(LeaveRequest.user_id.in_(team_member_ids)).all()
+        team_member_ids = db.session.query(User.id).filter(User.supervisor_id == current_user.id)
+        leaves_query = leaves_query.filter(or_(LeaveRequest.user_id.in_(team_member_ids), LeaveRequest.user_id == current_user.id))
     else:
-        leaves = leaves_query.filter_by(user_id=current_user.id).all()
+        leaves_query = leaves_query.filter_by(user_id=current_user.id)
+    tasks_query = PersonalTask.query.filter_by(user_id=current_user.id)
+
+    # Only what overlaps the visible window
+    if start_date and end_date:
+        holidays_query = holidays_query.filter(Holiday.date >= start_date, Holiday.date <= end_date)
+        leaves_query = leaves_query.filter(LeaveRequest.start_date <= end_date, LeaveRequest.end_date >= start_date)
+        tasks_query = tasks_query.filter(PersonalTask.date >= start_date, PersonalTask.date <= end_date)
+
+    employee = db.aliased(User) # aliased so the supervisor's team subquery is not correlated to the join
+    fingerprint = _events_fingerprint(
+        (holidays_query, (Holiday.id, Holiday.date, Holiday.name, Holiday.type)),
+        (leaves_query.join(employee, LeaveRequest.employee), (LeaveRequest.id, LeaveRequest.start_date, LeaveRequest.end_date, employee.name)),
+        (tasks_query, (PersonalTask.id, PersonalTask.date, PersonalTask.task_description)))
+    etag = hashlib.sha1(repr((current_user.id, current_user.role, start, end, fingerprint)).encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        if start_date and end_date:
+            for sunday in sundays_between(start_date, end_date, Holiday):
+                events.append({
+                    'title': 'Sunday Holiday', 'start': sunday.isoformat(), 'allDay': True,
+                    'backgroundColor': '#ffe5e5', 'borderColor': '#ffe5e5', 'display': 'background'
+                })
 
-    for l in leaves: events.append({'title': f"On Leave: {l.employee.name}", 'start': l.start_date.isoformat(), 'end': l.end_date.isoformat(), 'backgroundColor': '#2a9d8f', 'borderColor': '#2a9d8f'})
-    
-    tasks = PersonalTask.query.filter_by(user_id=current_user.id).all()
-    for t in tasks: events.append({'title': t.task_description, 'start': t.date.isoformat(), 'allDay': True, 'backgroundColor': '#264653', 'borderColor': '#264653'})
-    
-    return jsonify(events)
+        for h in holidays_query.all():
+            event_data = {'title': h.name, 'start': h.date.isoformat(), 'allDay': True}
+            if h.type == 'company_event':
+                event_data['backgroundColor'] = '#D90429'; event_data['borderColor'] = '#D90429'
+            else:
+                event_data['display'] = 'list-item'; event_data['backgroundColor'] = '#e76f51'; event_data['borderColor'] = '#e76f51'
+            events.append(event_data)
+
+        leaves = leaves_query.options(db.joinedload(LeaveRequest.employee)).all()
+        for l in leaves: events.append({'title': f"On Leave: {l.employee.name}", 'start': l.start_date.isoformat(), 'end': l.end_date.isoformat(), 'backgroundColor': '#2a9d8f', 'borderColor': '#2a9d8f'})
+
+        for t in tasks_query.all(): events.append({'title': t.task_description, 'start': t.date.isoformat(), 'allDay': True, 'backgroundColor': '#264653', 'borderColor': '#264653'})
+        response = jsonify(events)
+
+    response.set_etag(etag)
+    # Private to the user, and the browser must revalidate (cheaply) on every calendar flip
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def seed_default_roles():
+    """Creates the HR / Supervisor / Employee roles if the Role table is empty."""
+    if Role.query.count() == 0:
+        db.session.add(Role(name='HR', prefix='HR', base_role='hr'))
+        db.session.add(Role(name='Supervisor', prefix='SUP', base_role='supervisor'))
+        db.session.add(Role(name='Employee', prefix='EMP', base_role='employee'))
+        db.session.commit()
+        invalidate_role_registry()
 
 @app.cli.command("init-db")
 def init_db_command():
     """Clears the existing data and creates new tables."""
     db.create_all()
+    seed_default_roles()
     print("Initialized the database.")
 
+# Representative hot queries, used by migrate-db --explain to show the plans
+EXPLAIN_QUERIES = [
+    ("leaves of an employee", "SELECT * FROM leave_request WHERE user_id = 1 AND status = 'Approved'"),
+    ("pending leaves", "SELECT * FROM leave_request WHERE status = 'Pending' ORDER BY start_date DESC"),
+    ("attendance for a day", "SELECT * FROM attendance WHERE user_id = 1 AND date = '2025-01-01'"),
+    ("team members", "SELECT * FROM user WHERE supervisor_id = 1 ORDER BY employee_id"),
+    ("users by role", "SELECT * FROM user WHERE role = 'supervisor'"),
+    ("personal tasks", "SELECT * FROM personal_task WHERE user_id = 1"),
+    ("latest otp", "SELECT * FROM password_reset_otp WHERE user_id = 1 ORDER BY created_at DESC LIMIT 1"),
+]
+
+def _print_query_plans(title):
+    print(f"-- {title}")
+    with db.engine.connect() as conn:
+        for label, sql in EXPLAIN_QUERIES:
+            plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql).fetchall()
+            print(f"{label}: " + "; ".join(row[-1] for row in plan))
+
+@app.cli.command("run-payroll")
+@click.option('--month', required=True, help='Month to close, as YYYY-MM.')
+@click.option('--force', is_flag=True, help='Recompute a month that is already closed.')
+def run_payroll_command(month, force):
+    """Computes the payroll for a month and freezes it."""
+    try:
+        period = datetime.strptime(month, '%Y-%m')
+    except ValueError:
+        raise click.BadParameter('expected YYYY-MM', param_hint='--month')
+    run = _get_or_create_payroll_run(period.year, period.month)
+    if run.status == 'Closed' and not force:
+        print(f"Payroll for {month} is already closed. Use --force to recompute it.")
+        return
+    employees = User.query.order_by(User.employee_id).all()
+    invalidate_month_calendar(run.period_start)
+    payslips = calculate_payslips(employees, period.year, period.month, db, Holiday, LeaveRequest)
+    PayrollLine.query.filter_by(run_id=run.id).delete()
+    _save_payroll_lines(db.session, run, employees, payslips)
+    run.status = 'Closed'
+    run.closed_at = datetime.utcnow()
+    db.session.commit()
+    print(f"Closed payroll for {month}: {len(employees)} employees, net {sum(p['net_salary'] for p in payslips):.2f}.")
+
+@app.cli.command("outbox-worker")
+@click.option('--once', is_flag=True, help='Send what is due and exit.')
+def outbox_worker_command(once):
+    """Sends queued emails from the outbox (run as a separate process)."""
+    if once:
+        total = 0
+        while True:
+            processed = drain_outbox(db, OutboxEmail, mail)
+            if not processed: break
+            total += processed
+        print(f"Processed {total} queued emails.")
+    else:
+        run_worker(app, db, OutboxEmail, mail)
+
+@app.cli.command("generate-org")
+@click.option('--employees', type=click.IntRange(min=3), required=True, help='Number of users to create, supervisors and HR included.')
+@click.option('--years', default=2.0, show_default=True, help='Years of leave, attendance and task history up to today.')
+@click.option('--seed', default=0, show_default=True, help='Random seed; the same seed gives the same organisation.')
+@click.option('--password', default='password', show_default=True, help='Password of every generated user.')
+@click.option('--reset', is_flag=True, help='Drop all tables, search and leave indexes included, first. Destroys every row in the database.')
+def generate_org_command(employees, years, seed, password, reset):
+    """Fills the database with a synthetic organisation for load testing."""
+    if reset:
+        db.drop_all()
+        # The before_drop listeners drop these with their tables; dropped here too so a reset never depends on those tables existing
+        with db.engine.begin() as conn:
+            drop_search_index(conn)
+            drop_leave_index(conn)
+    db.create_all()
+    seed_default_roles()
+    started = time.perf_counter()
+    try:
+        counts = generate_organisation(db, User, LeaveRequest, Attendance, Holiday, PersonalTask, employees,
+                                       password_hasher.hash(password), years=years, seed=seed)
+    except ValueError as e:
+        raise click.ClickException(f"{e} Use --reset to start over.")
+    invalidate_month_calendar()
+    print(f"Generated in {time.perf_counter() - started:.1f}s: " + ", ".join(f"{n} {table}" for table, n in counts.items()) + ".")
+
+@app.cli.command("migrate-db")
+@click.option('--explain', is_flag=True, help='Print query plans of the hot queries before and after.')
+@click.option('--dedupe-attendance', is_flag=True, help='Keep only the latest Attendance row per (user_id, date) so the unique index can be built.')
+def migrate_db_command(explain, dedupe_attendance):
+    """Creates missing tables and indexes on an existing database without touching data."""
+    db.create_all()
+    if explain: _print_query_plans("before")
+
+    duplicates = db.session.execute(db.text(
+        "SELECT user_id, date, COUNT(*) FROM attendance GROUP BY user_id, date HAVING COUNT(*) > 1"
+    )).fetchall()
+    if duplicates and dedupe_attendance:
+        db.session.execute(db.text(
+            "DELETE FROM attendance WHERE id NOT IN (SELECT MAX(id) FROM attendance GROUP BY user_id, date)"
+        ))
+        db.session.commit()
+        print(f"Removed older duplicate attendance rows for {len(duplicates)} (user, date) pairs.")
+        duplicates = []
+
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.unique and duplicates and table.name == 'attendance':
+                print(f"Skipped {index.name}: {len(duplicates)} duplicate (user_id, date) pairs. Re-run with --dedupe-attendance.")
+                continue
+            index.create(bind=db.engine, checkfirst=True)
+    with db.engine.begin() as conn:
+        ensure_search_index(conn)
+        ensure_leave_index(conn)
+    db.session.execute(db.text("ANALYZE"))
+    db.session.commit()
+
+    if explain: _print_query_plans("after")
+    print("Database migrated.")
+
 @app.route('/settings', methods=['GET', 'POST'])
 @login_required
 def settings():
@@ -1058,6 +1876,7 @@ def settings():
     if not info:
         info = CompanyInfo()
         db.session.add(info); db.session.commit()
+        invalidate_company_info()
     
     if request.method == 'POST':
         info.name = request.form['name']
@@ -1066,6 +1885,7 @@ def settings():
         info.phone = request.form['phone']
         info.gstn = request.form.get('gstn', '')
         db.session.commit()
+        invalidate_company_info()
         flash('Company details updated!', 'success')
         return redirect(url_for('settings'))
     
@@ -1096,7 +1916,7 @@ def forgot_password():
             try:
                 msg = Message('Password Reset OTP', recipients=[email])
                 msg.body = f"Your OTP for password reset is: {otp}\n\nThis code expires in 10 minutes."
-                mail.send(msg)
+                queue_email(msg)
                 flash(f'OTP has been sent to {email}.', 'info')
             except Exception as e:
                 print(f"Mail Error: {e}")
@@ -1161,7 +1981,7 @@ def resend_otp():
     try:
         msg = Message('Password Reset OTP (Resent)', recipients=[user.email])
         msg.body = f"Your new OTP is: {otp}\n\nThis code expires in 10 minutes."
-        mail.send(msg)
+        queue_email(msg)
         flash('New OTP sent to your email!', 'success')
     except Exception as e:
         print(f"Mail Error: {e}")
@@ -1215,6 +2035,7 @@ def manage_categories():
             if role_to_del:
                 db.session.delete(role_to_del)
                 db.session.commit()
+                invalidate_role_registry()
                 flash('Category removed.', 'success')
         else:
             # Add Logic
@@ -1234,11 +2055,26 @@ def manage_categories():
                     new_role = Role(name=name, prefix=prefix, base_role=base)
                     db.session.add(new_role)
                     db.session.commit()
+                    invalidate_role_registry()
                     flash(f'Category {name} added.', 'success')
     
     categories = Role.query.all()
     return render_template('categories.html', categories=categories)
 
+def warm_up():
+    """Imports the heavy modules that are otherwise loaded on first use (numpy,
+    num2words, WeasyPrint) so that workers forked afterwards share one copy.
+    Deliberately opens no database connections, threads or process pools:
+    those must be created in each worker after the fork."""
+    import numpy  # noqa: F401
+    import num2words  # noqa: F401
+    weasyprint_available()
+
+if app.config['WARM_UP']:
+    warm_up()
+
 if __name__ == '__main__':
-    with app.app_context(): db.create_all()
+    with app.app_context():
+        db.create_all()
+        seed_default_roles()
     app.run(debug=True)
\ No newline at end of file
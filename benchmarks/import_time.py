@@ -0,0 +1,74 @@
+"""
+Cold import time of app.py, measured with `python -X importtime` in fresh
+interpreters, and a check that the lazily loaded heavy modules stay lazy.
+Exits non-zero when the median is over budget or a lazy module is imported,
+so it can guard against regressions in CI.
+
+    python benchmarks/import_time.py [--runs 5] [--budget-ms 1000] [--top 10]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Loaded on first use by the code that needs them (or by warm_up()); none of
+# these may be pulled in just by importing the app.
+LAZY_MODULES = ('numpy', 'pandas', 'num2words', 'weasyprint', 'multiprocessing', 'openpyxl')
+# Deliberately left eager: zipfile is already imported by Flask itself (through
+# importlib.metadata), so deferring it in payslip_pdf saves nothing; flask_mail
+# adds about 10 ms (the email.mime modules) and its Message objects are built
+# by many routes, so it is imported with the rest of the app.
+
+LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def measure():
+    env = dict(os.environ, WARM_UP='0')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = (int(self_us), int(cumulative_us), len(indent) // 2)
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=1000)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    totals = [run['app'][1] / 1000 for run in runs]
+    median = statistics.median(totals)
+    last = runs[-1]
+
+    print(f"import app: median {median:.0f} ms, min {min(totals):.0f} ms, max {max(totals):.0f} ms over {args.runs} runs")
+    print("top-level imports by cumulative time (last run):")
+    direct = sorted(((cum, name) for name, (_, cum, depth) in last.items() if depth == 1), reverse=True)
+    for cumulative_us, name in direct[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failed = False
+    eager = [name for name in LAZY_MODULES if name in last]
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}")
+        failed = True
+    if median > args.budget_ms:
+        print(f"FAIL: median {median:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    if not failed:
+        print(f"OK: within {args.budget_ms:.0f} ms and no lazy module imported")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""
+Login throughput under concurrent load, with password hashing done in the
+request thread (as before the hashing pool) and in the PasswordHasher pool.
+
+    python benchmarks/login_throughput.py [--users 40] [--threads 16] [--seconds 5] [--workers N]
+
+Scenarios, each with --threads clients hammering the app for --seconds:
+  login           POST /login/employee with the right password
+  login_rehash    every user logs in once while their stored hash uses older
+                  parameters, so each login also rehashes and saves
+  profile         POST /profile changing the password (a check and a hash)
+  reset_password  POST /reset_new_password after OTP verification (a hash)
+
+While they run, one more thread keeps requesting the home page; its latency
+shows how much a login storm slows everything else in the worker. Each mode
+runs in its own process against a fresh SQLite database.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+PASSWORD = 'password'
+LEGACY_METHOD = 'pbkdf2:sha256:1000' # stands in for hashes made before the parameters changed
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] if values else float('nan')
+
+
+def run_mode(users, threads, seconds):
+    """Runs every scenario; executes inside the per-mode process."""
+    sys.path.insert(0, ROOT)
+    from app import app, db, User, password_hasher, seed_default_roles
+    from passwords import hash_parameters
+    from werkzeug.security import generate_password_hash
+
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.create_all()
+        seed_default_roles()
+        current = password_hasher.hash(PASSWORD)
+        for i in range(users):
+            db.session.add(User(employee_id=f'LOAD{i:04d}', name=f'Load User {i}', email=f'load{i}@example.com',
+                                date_of_joining=date(2024, 1, 1), salary=30000, role='employee', password_hash=current))
+        db.session.commit()
+        ids = [u.id for u in User.query.filter(User.employee_id.like('LOAD%')).order_by(User.employee_id)]
+
+    def set_all_hashes(password_hash):
+        with app.app_context():
+            User.query.filter(User.employee_id.like('LOAD%')).update({'password_hash': password_hash})
+            db.session.commit()
+
+    def login(client, i):
+        client = client or app.test_client() # a fresh client each time, or an authenticated one skips the check
+        response = client.post('/login/employee', data={'employee_id': f'LOAD{i:04d}', 'password': PASSWORD})
+        return response.status_code == 302 and response.location.endswith('/dashboard')
+
+    def profile(client, i):
+        response = client.post('/profile', data={'current_password': PASSWORD, 'new_password': PASSWORD,
+                                                 'confirm_password': PASSWORD})
+        return response.status_code == 302 and response.location.endswith('/dashboard')
+
+    def reset_password(client, i):
+        with client.session_transaction() as session:
+            session['reset_user_id'] = ids[i]
+            session['otp_verified'] = True
+        response = client.post('/reset_new_password', data={'password': PASSWORD, 'confirm_password': PASSWORD})
+        return response.status_code == 302 and response.location.endswith('/login')
+
+    def storm(action, logged_in=False, once_each=False):
+        clients = [app.test_client() if logged_in or action is not login else None for _ in range(threads)]
+        if logged_in:
+            for t, client in enumerate(clients):
+                login(client, t % users)
+        latencies, bystander, counts = [], [], {'ok': 0, 'failed': 0}
+        lock = threading.Lock()
+        stop = threading.Event()
+        next_user = iter(range(users)) if once_each else None
+
+        def hammer(t):
+            local, n = [], 0
+            while not stop.is_set():
+                if once_each:
+                    with lock:
+                        i = next(next_user, None)
+                    if i is None:
+                        break
+                else:
+                    i = (t + n * threads) % users if not logged_in else t % users
+                    n += 1
+                started = time.perf_counter()
+                ok = action(clients[t], i)
+                local.append(time.perf_counter() - started)
+                with lock:
+                    counts['ok' if ok else 'failed'] += 1
+            with lock:
+                latencies.extend(local)
+
+        def watch():
+            client = app.test_client()
+            while not stop.is_set():
+                started = time.perf_counter()
+                client.get('/').get_data()
+                bystander.append(time.perf_counter() - started)
+                time.sleep(0.01)
+
+        workers = [threading.Thread(target=hammer, args=(t,)) for t in range(threads)]
+        watcher = threading.Thread(target=watch)
+        started = time.perf_counter()
+        watcher.start()
+        for w in workers: w.start()
+        if once_each:
+            for w in workers: w.join()
+        else:
+            time.sleep(seconds)
+        stop.set()
+        for w in workers: w.join()
+        watcher.join()
+        elapsed = time.perf_counter() - started
+        return {'ops': counts['ok'], 'failed': counts['failed'], 'seconds': elapsed,
+                'per_second': counts['ok'] / elapsed,
+                'p50_ms': percentile(latencies, 0.5) * 1000, 'p99_ms': percentile(latencies, 0.99) * 1000,
+                'bystander_p50_ms': percentile(bystander, 0.5) * 1000, 'bystander_p99_ms': percentile(bystander, 0.99) * 1000}
+
+    # Warm the pool (process start-up) and the app before timing anything
+    password_hasher.verify(current, PASSWORD)
+    app.test_client().get('/')
+
+    results = {'login': storm(login)}
+    set_all_hashes(generate_password_hash(PASSWORD, LEGACY_METHOD))
+    results['login_rehash'] = storm(login, once_each=True)
+    with app.app_context():
+        stale = sum(1 for (h,) in db.session.query(User.password_hash).filter(User.employee_id.like('LOAD%'))
+                    if h.split('$', 1)[0] != hash_parameters(password_hasher.method))
+    results['login_rehash']['still_stale'] = stale
+    results['profile'] = storm(profile, logged_in=True)
+    results['reset_password'] = storm(reset_password)
+    password_hasher.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--threads', type=int, default=16, help='Concurrent clients.')
+    parser.add_argument('--seconds', type=float, default=5, help='Duration of each timed scenario.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='PASSWORD_HASH_WORKERS for the pool run.')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        with open(args.output, 'w') as f:
+            json.dump(run_mode(args.users, args.threads, args.seconds), f)
+        return
+
+    # (label, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING): inline with no
+    # effective limit is how set_password/check_password behaved before
+    modes = [('inline', 0, 100000), (f'pool x{args.workers}', args.workers, 4 * args.workers)]
+    print(f"{args.threads} clients, {args.users} users, {args.seconds:g}s per scenario, {os.cpu_count()} CPUs")
+    for label, workers, max_pending in modes:
+        workdir = tempfile.mkdtemp(prefix='hr-login-bench-')
+        env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(workdir, 'bench.db'),
+                   PASSWORD_HASH_WORKERS=str(workers), PASSWORD_HASH_MAX_PENDING=str(max_pending),
+                   PASSWORD_HASH_WAIT_SECONDS='30', OUTBOX_WORKER_THREAD='0', METRICS_ENABLED='0', WARM_UP='0')
+        out = os.path.join(workdir, 'result.json')
+        subprocess.run([sys.executable, __file__, '--worker', '--users', str(args.users), '--threads', str(args.threads),
+                        '--seconds', str(args.seconds), '--output', out], env=env, check=True)
+        with open(out) as f:
+            results = json.load(f)
+        for name, r in results.items():
+            extra = f"  stale hashes left {r['still_stale']}" if 'still_stale' in r else ''
+            print(f"{label:>10} {name:<15} {r['per_second']:7.1f}/s  p50 {r['p50_ms']:7.0f} ms  p99 {r['p99_ms']:7.0f} ms  "
+                  f"home page p50 {r['bystander_p50_ms']:6.1f} ms  p99 {r['bystander_p99_ms']:6.1f} ms  "
+                  f"failed {r['failed']}{extra}")
+
+
+if __name__ == '__main__':
+    main()
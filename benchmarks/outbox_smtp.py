@@ -0,0 +1,112 @@
+"""
+Checks the outbox worker against a local aiosmtpd stand-in server: a message
+the server refuses is retried on its own while the rest of the batch is
+delivered, and a server that is down reschedules the whole batch. Exits
+non-zero if either does not hold.
+
+    pip install aiosmtpd
+    python benchmarks/outbox_smtp.py
+"""
+import os
+import socket
+import sys
+import tempfile
+
+# A throwaway database and no background sender: the check drains the outbox itself
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='hr-outbox-'), 'outbox.db')
+os.environ['OUTBOX_WORKER_THREAD'] = '0'
+os.environ['METRICS_ENABLED'] = '0'
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app import app, db, mail, OutboxEmail, queue_email
+from flask_mail import Message
+from outbox import drain_outbox
+
+REFUSED = 'bad@example.com'
+
+
+class StandIn:
+    """Accepts every recipient except REFUSED and keeps what it was sent."""
+    def __init__(self):
+        self.delivered = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address == REFUSED:
+            return '550 5.1.1 Mailbox unavailable'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.delivered.extend(envelope.rcpt_tos)
+        return '250 Message accepted'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def message(recipient):
+    msg = Message(f"Hello {recipient}", recipients=[recipient])
+    msg.body = "Outbox check"
+    return msg
+
+
+def outbox_rows():
+    return {row.recipients: row for row in OutboxEmail.query.all()}
+
+
+def main():
+    try:
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        print("aiosmtpd is not installed (pip install aiosmtpd)")
+        return 2
+
+    port = free_port()
+    app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=port, MAIL_USE_TLS=False, MAIL_USE_SSL=False,
+                      MAIL_USERNAME=None, MAIL_PASSWORD=None)
+    mail.state = mail.init_app(app)
+    handler = StandIn()
+    controller = Controller(handler, hostname='127.0.0.1', port=port)
+    failures = []
+
+    with app.app_context():
+        db.create_all()
+
+        # The refused message comes first, as it would again on every retry
+        controller.start()
+        try:
+            queue_email(message(REFUSED), message('one@example.com'), message('two@example.com'))
+            drain_outbox(db, OutboxEmail, mail)
+        finally:
+            controller.stop()
+        rows = outbox_rows()
+        if sorted(handler.delivered) != ['one@example.com', 'two@example.com']:
+            failures.append(f"delivered {handler.delivered}, expected both accepted messages")
+        if set(rows) != {REFUSED}:
+            failures.append(f"left in the outbox: {sorted(rows)}, expected only {REFUSED}")
+        elif rows[REFUSED].status != 'Pending' or rows[REFUSED].attempts != 1 or '550' not in (rows[REFUSED].last_error or ''):
+            failures.append(f"refused message is {rows[REFUSED].status} after {rows[REFUSED].attempts} attempts: "
+                            f"{rows[REFUSED].last_error}")
+
+        # Server down: nothing is sent and every message is rescheduled
+        db.session.query(OutboxEmail).delete()
+        db.session.commit()
+        queue_email(message('three@example.com'), message('four@example.com'))
+        drain_outbox(db, OutboxEmail, mail)
+        rows = outbox_rows()
+        if sorted(rows) != ['four@example.com', 'three@example.com'] or any(
+                row.status != 'Pending' or row.attempts != 1 for row in rows.values()):
+            failures.append("with the server down, the batch was not rescheduled: "
+                            + ", ".join(f"{r} {row.status}/{row.attempts}" for r, row in rows.items()))
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print("OK: refused messages are retried alone and a dropped server reschedules the batch")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Guards against N+1 queries: counts the SQL statements of the main
+supervisor's /dashboard and of /api/events against synthetic organisations of
+two sizes, and exits non-zero if any count grows with the number of rows.
+
+    python benchmarks/query_counts.py [--sizes 20,200]
+
+Each size runs in its own process against a fresh SQLite database. Every page
+is requested once to warm the per-process caches (roles, company info,
+calendars) and counted on the second request.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import date, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+PASSWORD = 'password'
+
+
+def count_queries(employees):
+    """Statements per page for one organisation size; runs inside the per-size process."""
+    sys.path.insert(0, ROOT)
+    from sqlalchemy import event
+    from app import (app, db, User, LeaveRequest, Attendance, Holiday, PersonalTask, MAIN_SUPERVISOR_ID,
+                     password_hasher, seed_default_roles)
+    from synthetic import generate_organisation
+
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.create_all()
+        seed_default_roles()
+        password_hash = password_hasher.hash(PASSWORD)
+        db.session.add(User(employee_id=MAIN_SUPERVISOR_ID, name='Main Supervisor', email='main@example.com',
+                            date_of_joining=date(2020, 1, 1), salary=90000, role='supervisor', password_hash=password_hash))
+        db.session.commit()
+        generate_organisation(db, User, LeaveRequest, Attendance, Holiday, PersonalTask, employees, password_hash,
+                              years=0.25, seed=0)
+        leaves = LeaveRequest.query.count()
+
+    client = app.test_client()
+    response = client.post('/login/supervisor', data={'employee_id': MAIN_SUPERVISOR_ID, 'password': PASSWORD})
+    if response.status_code != 302:
+        raise RuntimeError("Could not log in as the main supervisor")
+
+    today = date.today()
+    pages = {
+        'dashboard': '/dashboard',
+        'api_events': f"/api/events?start={(today - timedelta(days=90)).isoformat()}T00:00:00"
+                      f"&end={(today + timedelta(days=60)).isoformat()}T00:00:00",
+    }
+    statements = [0]
+    def on_execute(*args):
+        statements[0] += 1
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', on_execute)
+
+    counts = {}
+    for name, url in pages.items():
+        client.get(url).get_data()
+        statements[0] = 0
+        response = client.get(url)
+        response.get_data()
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {response.status_code}")
+        counts[name] = statements[0]
+    return {'leave_requests': leaves, 'counts': counts}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='20,200', help='Comma separated employee counts.')
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        with open(args.output, 'w') as f:
+            json.dump(count_queries(args.worker), f)
+        return 0
+
+    results = {}
+    for employees in [int(s) for s in args.sizes.split(',')]:
+        workdir = tempfile.mkdtemp(prefix=f'hr-queries-{employees}-')
+        env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(workdir, 'queries.db'),
+                   PAYSLIP_CACHE_DIR=os.path.join(workdir, 'payslip_cache'),
+                   OUTBOX_WORKER_THREAD='0', METRICS_ENABLED='0', WARM_UP='0', PASSWORD_HASH_WORKERS='0')
+        out = os.path.join(workdir, 'result.json')
+        subprocess.run([sys.executable, __file__, '--worker', str(employees), '--output', out], env=env, check=True)
+        with open(out) as f:
+            results[employees] = json.load(f)
+
+    failed = False
+    for page in next(iter(results.values()))['counts']:
+        counts = {size: result['counts'][page] for size, result in results.items()}
+        print(f"{page:<12} " + "  ".join(f"{size} employees ({results[size]['leave_requests']} leaves): {n} statements"
+                                          for size, n in counts.items()))
+        if len(set(counts.values())) > 1:
+            print(f"FAIL: {page} runs more statements as the organisation grows")
+            failed = True
+    if not failed:
+        print("OK: statement counts do not depend on the number of rows")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Reader latency while a writer holds the database, with the default rollback
+journal vs. the WAL settings the app applies on connect.
+
+    python benchmarks/sqlite_concurrency.py [--readers 8] [--seconds 3]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app import app, apply_sqlite_pragmas
+
+
+def connect(path, config):
+    conn = sqlite3.connect(path, timeout=config['SQLITE_BUSY_TIMEOUT'] / 1000, isolation_level=None, check_same_thread=False)
+    apply_sqlite_pragmas(conn, config)
+    return conn
+
+
+def run(journal_mode, readers, seconds):
+    config = dict(app.config, SQLITE_JOURNAL_MODE=journal_mode)
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    setup = connect(path, config)
+    setup.execute("CREATE TABLE attendance (id INTEGER PRIMARY KEY, user_id INTEGER, date TEXT, status TEXT)")
+    setup.executemany("INSERT INTO attendance (user_id, date, status) VALUES (?, '2025-01-01', 'Present')", [(i,) for i in range(5000)])
+    setup.close()
+
+    stop = threading.Event()
+    latencies = []
+    writes = [0]
+    lock = threading.Lock()
+
+    def writer():
+        conn = connect(path, config)
+        while not stop.is_set():
+            # An exclusive write transaction held for a moment, like a commit
+            # of an attendance mark or a leave approval under load.
+            conn.execute("BEGIN EXCLUSIVE")
+            conn.execute("UPDATE attendance SET status = 'Leave' WHERE user_id = ?", (writes[0] % 5000,))
+            time.sleep(0.02)
+            conn.execute("COMMIT")
+            writes[0] += 1
+        conn.close()
+
+    def reader():
+        conn = connect(path, config)
+        local = []
+        while not stop.is_set():
+            started = time.perf_counter()
+            conn.execute("SELECT COUNT(*) FROM attendance WHERE status = 'Present'").fetchone()
+            local.append(time.perf_counter() - started)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(readers)]
+    for t in threads: t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads: t.join()
+
+    latencies.sort()
+    p = lambda q: latencies[min(int(len(latencies) * q), len(latencies) - 1)] * 1000
+    print(f"{journal_mode:>6}: {len(latencies) / seconds:8.0f} reads/s  p50 {p(0.5):6.2f} ms  p99 {p(0.99):6.2f} ms  max {latencies[-1] * 1000:6.2f} ms  writes {writes[0]}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=3)
+    args = parser.parse_args()
+    run('DELETE', args.readers, args.seconds)
+    run('WAL', args.readers, args.seconds)
@@ -0,0 +1,208 @@
+"""
+Times the hot paths (payslip calculation, payroll report, dashboards per role,
+attendance, calendar events, bulk payslip download) against synthetic
+organisations of several sizes, and stores the results as JSON so two commits
+can be compared.
+
+    python benchmarks/suite.py [--sizes 100,1000,10000] [--years 1] [--repeat 5] [--output FILE]
+    python benchmarks/suite.py --compare OLD.json NEW.json [--threshold 1.25]
+
+Each size runs in its own process against a fresh SQLite database built with
+synthetic.generate_organisation, so caches start cold and sizes do not affect
+each other. Results go to instance/benchmarks/<time>_<commit>.json by default.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+PASSWORD = 'password'
+NOISE_FLOOR_SECONDS = 0.005 # slowdowns smaller than this are never reported as regressions
+
+
+def git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(timings):
+    return {
+        'first': timings[0],
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.fmean(timings),
+        'max': max(timings),
+        'runs': len(timings),
+    }
+
+
+def run_size(employees, years, repeat, seed):
+    """Builds the organisation and times every benchmark; runs inside the per-size process."""
+    sys.path.insert(0, ROOT)
+    from app import app, db, User, LeaveRequest, Attendance, Holiday, PersonalTask, seed_default_roles
+    from payroll import calculate_payslip, calculate_payslips
+    from synthetic import generate_organisation
+    from werkzeug.security import generate_password_hash
+
+    app.config['TESTING'] = True
+    today = date.today()
+    with app.app_context():
+        db.create_all()
+        seed_default_roles()
+        started = time.perf_counter()
+        rows = generate_organisation(db, User, LeaveRequest, Attendance, Holiday, PersonalTask, employees,
+                                     generate_password_hash(PASSWORD), years=years, seed=seed)
+        generate_seconds = time.perf_counter() - started
+        db.session.execute(db.text("ANALYZE"))
+        db.session.commit()
+
+        users = {role: User.query.filter_by(role=role).order_by(User.employee_id).first() for role in ('hr', 'supervisor', 'employee')}
+        logins = {role: user.employee_id for role, user in users.items()}
+        employee_pk = users['employee'].id
+
+    clients = {}
+    for role, employee_id in logins.items():
+        client = clients[role] = app.test_client()
+        response = client.post(f'/login/{role}', data={'employee_id': employee_id, 'password': PASSWORD})
+        if response.status_code != 302:
+            raise RuntimeError(f"Could not log in as {role} {employee_id}")
+
+    def get(role, url):
+        def call():
+            response = clients[role].get(url)
+            response.get_data() # drain streamed bodies
+            if response.status_code != 200:
+                raise RuntimeError(f"GET {url} as {role} returned {response.status_code}")
+        return call
+
+    def in_app(fn):
+        def call():
+            with app.app_context():
+                fn()
+        return call
+
+    def one_payslip():
+        calculate_payslip(db.session.get(User, employee_pk), today.year, today.month, db, Holiday, LeaveRequest)
+
+    def all_payslips():
+        calculate_payslips(User.query.all(), today.year, today.month, db, Holiday, LeaveRequest)
+
+    month_start = today.replace(day=1).isoformat()
+    events = f'/api/events?start={month_start}T00:00:00&end={today.isoformat()}T23:59:59'
+
+    # (name, callable, maximum runs); the whole-company download is capped because it renders every payslip
+    benchmarks = [
+        ('calculate_payslip', in_app(one_payslip), repeat),
+        ('calculate_payslips_all', in_app(all_payslips), repeat),
+        ('payroll_report_month', get('hr', '/payroll_report'), repeat),
+        ('payroll_report_week', get('hr', '/payroll_report?view_type=week'), repeat),
+        ('dashboard_hr', get('hr', '/dashboard'), repeat),
+        ('dashboard_supervisor', get('supervisor', '/dashboard'), repeat),
+        ('dashboard_employee', get('employee', '/dashboard'), repeat),
+        ('attendance_hr', get('hr', '/attendance'), repeat),
+        ('attendance_supervisor', get('supervisor', '/attendance'), repeat),
+        ('api_events_hr', get('hr', events), repeat),
+        ('api_events_employee', get('employee', events), repeat),
+        ('download_all_payslips', get('hr', '/download_all_payslips'), min(repeat, 2)),
+    ]
+    results = {}
+    for name, call, runs in benchmarks:
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            call()
+            timings.append(time.perf_counter() - started)
+        results[name] = summarize(timings)
+        print(f"  {employees:>6} {name:<24} median {results[name]['median'] * 1000:9.1f} ms  first {timings[0] * 1000:9.1f} ms",
+              file=sys.stderr)
+    return {'rows': rows, 'generate_seconds': generate_seconds, 'benchmarks': results}
+
+
+def run_all(sizes, years, repeat, seed):
+    report = {
+        'commit': git('rev-parse', 'HEAD'),
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'years': years,
+        'repeat': repeat,
+        'seed': seed,
+        'sizes': {},
+    }
+    for employees in sizes:
+        workdir = tempfile.mkdtemp(prefix=f'hr-bench-{employees}-')
+        env = dict(os.environ,
+                   DATABASE_URL='sqlite:///' + os.path.join(workdir, 'bench.db'),
+                   PAYSLIP_CACHE_DIR=os.path.join(workdir, 'payslip_cache'),
+                   OUTBOX_WORKER_THREAD='0', METRICS_ENABLED='0', WARM_UP='0')
+        out = os.path.join(workdir, 'result.json')
+        subprocess.run([sys.executable, __file__, '--worker', str(employees), '--years', str(years), '--repeat', str(repeat),
+                        '--seed', str(seed), '--output', out], env=env, check=True)
+        with open(out) as f:
+            report['sizes'][str(employees)] = json.load(f)
+    return report
+
+
+def compare(old_path, new_path, threshold):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{(old['commit'] or '?')[:10]} -> {(new['commit'] or '?')[:10]} (median, ratio > {threshold} flagged)")
+    regressions = 0
+    for size, entry in new['sizes'].items():
+        before = old['sizes'].get(size, {}).get('benchmarks', {})
+        for name, stats in entry['benchmarks'].items():
+            if name not in before:
+                continue
+            a, b = before[name]['median'], stats['median']
+            ratio = b / a if a else float('inf')
+            flagged = ratio > threshold and b - a > NOISE_FLOOR_SECONDS
+            regressions += flagged
+            print(f"{size:>6} {name:<24} {a * 1000:9.1f} ms -> {b * 1000:9.1f} ms  x{ratio:5.2f}{'  REGRESSION' if flagged else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='100,1000,10000', help='Comma separated employee counts.')
+    parser.add_argument('--years', type=float, default=1, help='Years of history in each organisation.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per benchmark; the first one is also reported on its own.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Where to write the JSON results.')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two result files instead of running.')
+    parser.add_argument('--threshold', type=float, default=1.25, help='Median slowdown ratio reported as a regression.')
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    if args.worker:
+        result = run_size(args.worker, args.years, args.repeat, args.seed)
+        with open(args.output, 'w') as f:
+            json.dump(result, f)
+        return
+
+    report = run_all([int(s) for s in args.sizes.split(',')], args.years, args.repeat, args.seed)
+    output = args.output or os.path.join(
+        ROOT, 'instance', 'benchmarks', f"{time.strftime('%Y%m%d-%H%M%S')}_{(report['commit'] or 'unknown')[:10]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+
+
+if __name__ == '__main__':
+    main()
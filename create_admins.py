@@ -16,28 +16,30 @@ def ensure_user(employee_id, name, email, doj, salary, role, password):
     db.session.add(u)
     return True
 
-with app.app_context():
-    created_any = False
-    created_any |= ensure_user(
-        employee_id="HR001",
-        name="HR Admin",
-        email="hr@company.com",
-        doj=date(2025, 9, 24),
-        salary=80000,
-        role="hr",
-        password="hr_password",
-    )
-    created_any |= ensure_user(
-        employee_id="MAIN_SUPERVISOR",
-        name="Main Supervisor",
-        email="supervisor@company.com",
-        doj=date(2025, 9, 24),
-        salary=90000,
-        role="supervisor",
-        password="supervisor_password",
-    )
-    if created_any:
-        db.session.commit()
-        print("HR and Main Supervisor users created successfully.")
-    else:
-        print("Admin users already exist. No changes made.")
+# Password hashing may start worker processes, which re-import this script
+if __name__ == '__main__':
+    with app.app_context():
+        created_any = False
+        created_any |= ensure_user(
+            employee_id="HR001",
+            name="HR Admin",
+            email="hr@company.com",
+            doj=date(2025, 9, 24),
+            salary=80000,
+            role="hr",
+            password="hr_password",
+        )
+        created_any |= ensure_user(
+            employee_id="MAIN_SUPERVISOR",
+            name="Main Supervisor",
+            email="supervisor@company.com",
+            doj=date(2025, 9, 24),
+            salary=90000,
+            role="supervisor",
+            password="supervisor_password",
+        )
+        if created_any:
+            db.session.commit()
+            print("HR and Main Supervisor users created successfully.")
+        else:
+            print("Admin users already exist. No changes made.")
@@ -0,0 +1,255 @@
+import csv
+import io
+import math
+import os
+import secrets
+from datetime import date, datetime
+
+# Bulk employee import from a CSV or XLSX sheet with one user per row. Every
+# row is checked before anything is written: field formats first, then
+# uniqueness of employee ID, email, name and phone against the rest of the
+# file and against the database with one IN query per column per chunk of
+# rows, and supervisors are resolved the same way. Valid rows are inserted together; invalid ones come
+# back in a per-row report so the sheet can be fixed and those rows re-uploaded.
+IMPORT_MAX_ROWS = 20000
+LOOKUP_CHUNK = 500 # values per IN (...) query
+
+# Header (case and spacing ignored) -> User column
+COLUMN_ALIASES = {
+    'employee id': 'employee_id', 'employee_id': 'employee_id', 'id': 'employee_id',
+    'name': 'name', 'full name': 'name',
+    'email': 'email', 'email address': 'email',
+    'phone': 'phone_number', 'phone number': 'phone_number', 'phone_number': 'phone_number', 'mobile': 'phone_number',
+    'address': 'address',
+    'date of joining': 'date_of_joining', 'date_of_joining': 'date_of_joining', 'joining date': 'date_of_joining',
+    'salary': 'salary',
+    'role': 'role',
+    'supervisor': 'supervisor', 'supervisor id': 'supervisor', 'supervisor_id': 'supervisor',
+    'password': 'password',
+}
+REQUIRED_FIELDS = ('employee_id', 'name', 'email', 'date_of_joining', 'salary', 'role')
+UNIQUE_FIELDS = (('employee_id', 'Employee ID'), ('email', 'Email'), ('name', 'Name'), ('phone_number', 'Phone Number'))
+CASE_INSENSITIVE_FIELDS = {'employee_id', 'email', 'name'} # 'HR@X.COM' duplicates 'hr@x.com'
+
+MAX_LENGTHS = {'employee_id': 50, 'name': 100, 'email': 100, 'phone_number': 20, 'address': 200}
+
+class ImportFileError(ValueError):
+    """The file itself cannot be imported (unknown format, no header, too many rows)."""
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value) # phone numbers and IDs typed into a numeric cell
+    return str(value).strip()
+
+def read_sheet(stream, filename):
+    """
+    (row_number, {field: value}) for every non-empty row of a .csv or .xlsx
+    upload, with headers mapped through COLUMN_ALIASES. Row numbers match the
+    spreadsheet (the header is row 1).
+    """
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.csv':
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        rows = csv.reader(text)
+    elif extension == '.xlsx':
+        from openpyxl import load_workbook # only needed for XLSX uploads
+        try:
+            workbook = load_workbook(stream, read_only=True, data_only=True)
+        except Exception as e:
+            raise ImportFileError(f"Could not read the spreadsheet: {e}")
+        rows = workbook.active.iter_rows(values_only=True)
+    else:
+        raise ImportFileError("Upload a .csv or .xlsx file.")
+
+    header = next(rows, None)
+    if not header:
+        raise ImportFileError("The file is empty.")
+    fields = [COLUMN_ALIASES.get(' '.join(_text(h).lower().split())) for h in header]
+    missing = [f for f in REQUIRED_FIELDS if f not in fields]
+    if missing:
+        raise ImportFileError("Missing columns: " + ", ".join(missing) + ".")
+
+    parsed = []
+    for number, values in enumerate(rows, start=2):
+        record = {field: value for field, value in zip(fields, values) if field}
+        if not any(_text(v) for v in record.values()):
+            continue
+        if len(parsed) >= IMPORT_MAX_ROWS:
+            raise ImportFileError(f"At most {IMPORT_MAX_ROWS} rows can be imported at once.")
+        parsed.append((number, record))
+    return parsed
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(_text(value), '%Y-%m-%d').date()
+
+def _clean_row(record, roles):
+    """
+    Field-level checks for one row. Returns (values, errors); roles maps a
+    lower-case role name to (name, base_role).
+    """
+    from email_validator import validate_email, EmailNotValidError
+    errors = []
+    values = {field: _text(record.get(field)) for field in ('employee_id', 'name', 'email', 'phone_number', 'address', 'supervisor')}
+    values['employee_id'] = values['employee_id'].upper() # logins upper-case the ID
+    values['supervisor'] = values['supervisor'].upper()
+    for field in REQUIRED_FIELDS:
+        if not _text(record.get(field)):
+            errors.append(f"{field.replace('_', ' ').capitalize()} is required.")
+    for field, limit in MAX_LENGTHS.items():
+        if len(values[field]) > limit:
+            errors.append(f"{field.replace('_', ' ').capitalize()} is longer than {limit} characters.")
+    if values['email']:
+        try:
+            values['email'] = validate_email(values['email'], check_deliverability=False).normalized
+        except EmailNotValidError as e:
+            errors.append(f"Email: {e}")
+    if _text(record.get('date_of_joining')):
+        try:
+            values['date_of_joining'] = _parse_date(record['date_of_joining'])
+        except ValueError:
+            errors.append("Date of joining must be YYYY-MM-DD.")
+    if _text(record.get('salary')):
+        try:
+            values['salary'] = float(_text(record['salary']).replace(',', ''))
+            if not math.isfinite(values['salary']) or values['salary'] < 0:
+                raise ValueError
+        except ValueError:
+            errors.append("Salary must be a number, 0 or more.")
+    role = roles.get(_text(record.get('role')).lower())
+    if _text(record.get('role')) and role is None:
+        errors.append(f"Unknown role '{_text(record.get('role'))}'.")
+    values['role'], values['base_role'] = role if role else (None, None)
+    values['password'] = _text(record.get('password'))
+    return values, errors
+
+def _existing(db, column, values, fold_case=False):
+    """The subset of values already present in column, with one query per
+    LOOKUP_CHUNK values. With fold_case, values and column are compared lower-cased
+    and the lower-cased matches are returned."""
+    if fold_case:
+        column = db.func.lower(column)
+        values = {v.lower() for v in values}
+    values = list(values)
+    found = set()
+    for i in range(0, len(values), LOOKUP_CHUNK):
+        found.update(v for (v,) in db.session.query(column).filter(column.in_(values[i:i + LOOKUP_CHUNK])))
+    return found
+
+def validate_rows(db, User, rows, roles, importer_base_role):
+    """
+    Checks parsed rows as a batch. Supervisors may only import employees, who
+    then report to them; HR may import any role and name a supervisor by
+    employee ID (an existing supervisor or one imported in the same file).
+    Returns (valid, errors): valid is a list of (row_number, values) and errors
+    a list of {'row', 'employee_id', 'errors'}.
+    """
+    cleaned = [(number, *_clean_row(record, roles)) for number, record in rows]
+
+    # Duplicates inside the file: the first occurrence wins, later ones are reported
+    for field, label in UNIQUE_FIELDS:
+        seen = {}
+        for number, values, errors in cleaned:
+            key = values[field].lower()
+            if not key:
+                continue
+            if key in seen:
+                errors.append(f"{label} '{values[field]}' is repeated from row {seen[key]}.")
+            else:
+                seen[key] = number
+
+    for field, label in UNIQUE_FIELDS:
+        fold_case = field in CASE_INSENSITIVE_FIELDS
+        taken = _existing(db, getattr(User, field), {values[field] for _, values, _ in cleaned if values[field]}, fold_case)
+        for _, values, errors in cleaned:
+            if (values[field].lower() if fold_case else values[field]) in taken:
+                errors.append(f"{label} '{values[field]}' already exists.")
+
+    existing_supervisors = _users_by_employee_id(
+        db, User, {values['supervisor'] for _, values, _ in cleaned if values['supervisor']}, User.role)
+    supervisor_roles = {name.lower() for name, base in roles.values() if base == 'supervisor'} | {'supervisor'}
+
+    candidates, report = [], []
+    for number, values, errors in cleaned:
+        if importer_base_role == 'supervisor':
+            if values['base_role'] and values['base_role'] != 'employee':
+                errors.append("Supervisors can only import employees.")
+            values['supervisor'] = ''
+        elif values['supervisor'] in existing_supervisors:
+            if existing_supervisors[values['supervisor']][1].lower() not in supervisor_roles:
+                errors.append(f"{values['supervisor']} is not a supervisor.")
+        if errors:
+            report.append({'row': number, 'employee_id': values['employee_id'], 'errors': errors})
+        else:
+            candidates.append((number, values))
+
+    # Rows reporting to someone in the same file are accepted in levels, each
+    # once its supervisor has been; what is left refers to a missing or rejected
+    # supervisor (or a cycle)
+    accepted = set()
+    valid, level = [], 0
+    pending = candidates
+    while pending:
+        ready = [(n, v) for n, v in pending if not v['supervisor'] or v['supervisor'] in existing_supervisors
+                 or v['supervisor'] in accepted]
+        if not ready:
+            break
+        for number, values in ready:
+            values['level'] = level
+            valid.append((number, values))
+        accepted.update(v['employee_id'] for _, v in ready if v['base_role'] == 'supervisor')
+        ready_rows = {n for n, _ in ready}
+        pending = [(n, v) for n, v in pending if n not in ready_rows]
+        level += 1
+    for number, values in pending:
+        report.append({'row': number, 'employee_id': values['employee_id'],
+                       'errors': [f"Supervisor '{values['supervisor']}' not found."]})
+    report.sort(key=lambda entry: entry['row'])
+    return valid, report
+
+def _users_by_employee_id(db, User, employee_ids, *columns):
+    """{employee_id: (id, *columns)} for the users among employee_ids, in chunked IN queries."""
+    employee_ids = list(employee_ids)
+    found = {}
+    for i in range(0, len(employee_ids), LOOKUP_CHUNK):
+        for employee_id, *rest in db.session.query(User.employee_id, User.id, *columns).filter(
+                User.employee_id.in_(employee_ids[i:i + LOOKUP_CHUNK])):
+            found[employee_id] = tuple(rest)
+    return found
+
+def insert_users(db, User, valid, hasher, importer_id=None):
+    """
+    Inserts validated rows with bulk_insert_mappings, one batch per supervisor
+    level, and returns one dict per new user including the password to mail
+    (generated when the row had none). Passwords are hashed with
+    hasher.hash_many (a passwords.PasswordHasher).
+    """
+    passwords = [values['password'] or secrets.token_urlsafe(9) for _, values in valid]
+    hashes = hasher.hash_many(passwords)
+
+    created = []
+    for (_, values), password, password_hash in zip(valid, passwords, hashes):
+        created.append({
+            'employee_id': values['employee_id'], 'name': values['name'], 'email': values['email'],
+            'phone_number': values['phone_number'] or None, 'address': values['address'] or None,
+            'date_of_joining': values['date_of_joining'], 'salary': values['salary'], 'role': values['role'],
+            'supervisor_id': importer_id, 'password_hash': password_hash,
+            'supervisor': values['supervisor'], 'level': values['level'], 'password': password,
+        })
+    columns = ('employee_id', 'name', 'email', 'phone_number', 'address', 'date_of_joining', 'salary', 'role',
+               'supervisor_id', 'password_hash')
+    for level in range(max((u['level'] for u in created), default=-1) + 1):
+        batch = [u for u in created if u['level'] == level]
+        supervisors = _users_by_employee_id(db, User, {u['supervisor'] for u in batch if u['supervisor']})
+        for u in batch:
+            if u['supervisor']:
+                u['supervisor_id'] = supervisors[u['supervisor']][0]
+        db.session.bulk_insert_mappings(User, [{c: u[c] for c in columns} for u in batch])
+    for u in created:
+        del u['password_hash'], u['level']
+    return created
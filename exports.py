@@ -0,0 +1,94 @@
+import csv
+import tempfile
+
+# Spreadsheet exports. Rows come from generators that read employees in keyset
+# batches, so memory stays flat however many rows are exported. CSV is encoded
+# and sent row by row as it is produced. XLSX is a zip whose directory can only
+# be written after the last row, so it is built with openpyxl's write-only mode
+# (rows go to a temporary file, not a cell tree) and streamed from disk in chunks.
+EXPORT_BATCH_SIZE = 1000
+XLSX_CHUNK_BYTES = 64 * 1024
+CSV_MIMETYPE = 'text/csv; charset=utf-8'
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+EXPORT_FORMATS = {'csv': CSV_MIMETYPE, 'xlsx': XLSX_MIMETYPE}
+
+def keyset_batches(query, column, size=EXPORT_BATCH_SIZE):
+    """
+    Yields the rows of query in lists of up to size, ordered by column (unique),
+    each batch fetched with a fresh `column > last` query.
+    """
+    last = None
+    while True:
+        batch_query = query if last is None else query.filter(column > last)
+        batch = batch_query.order_by(column).limit(size).all()
+        if not batch:
+            return
+        yield batch
+        last = getattr(batch[-1], column.key)
+
+def _cell(value):
+    # Spreadsheet apps run text starting with these as a formula; names and reasons are user input
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@', '\t', '\r'):
+        return "'" + value
+    return value
+
+class _Line:
+    def __init__(self):
+        self.value = ''
+    def write(self, text):
+        self.value = text
+
+def csv_stream(header, rows):
+    """
+    CSV bytes, one encoded line per row. Starts with a UTF-8 byte order mark so
+    Excel reads non-ASCII names correctly.
+    """
+    line = _Line()
+    writer = csv.writer(line)
+    writer.writerow(header)
+    yield ('\ufeff' + line.value).encode('utf-8')
+    for row in rows:
+        writer.writerow([_cell(v) for v in row])
+        yield line.value.encode('utf-8')
+
+def xlsx_stream(title, header, rows, column_widths=None):
+    """
+    XLSX bytes for one worksheet, built in openpyxl write-only mode and spooled
+    through a temporary file.
+    """
+    from openpyxl import Workbook # only needed for XLSX exports
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title[:31]) # Excel's limit on sheet names
+    for i, width in enumerate(column_widths or []):
+        sheet.column_dimensions[get_column_letter(i + 1)].width = width
+    sheet.freeze_panes = 'C2'
+    bold = Font(bold=True)
+    header_cells = []
+    for name in header:
+        cell = WriteOnlyCell(sheet, value=name)
+        cell.font = bold
+        header_cells.append(cell)
+    sheet.append(header_cells)
+    for row in rows:
+        sheet.append([_cell(v) for v in row])
+
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while True:
+            chunk = f.read(XLSX_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+def export_stream(fmt, title, header, rows, column_widths=None):
+    """
+    The body of an export in fmt ('csv' or 'xlsx').
+    """
+    if fmt == 'xlsx':
+        return xlsx_stream(title, header, rows, column_widths)
+    return csv_stream(header, rows)
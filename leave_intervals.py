@@ -0,0 +1,98 @@
+# Interval index over active leave requests: an R*Tree keyed by request id with
+# one box per leave, user_id on one axis and the covered days on the other, so
+# "this employee's leaves touching these dates" and "everybody's leaves in this
+# month" are both tree searches instead of scans over every leave ever taken.
+# Only Pending and Approved requests are indexed (declined ones never block or
+# count), and triggers on leave_request keep it in sync with every write.
+ACTIVE_STATUSES = ('Pending', 'Approved')
+
+# Days are stored as integers (days since 1970-01-01) in an integer R*Tree
+_DAY = "CAST(julianday({}) - 2440587.5 AS INTEGER)"
+_ROW = f"new.id, new.user_id, new.user_id, {_DAY.format('new.start_date')}, {_DAY.format('new.end_date')}"
+_ACTIVE = "new.status IN ('Pending', 'Approved')"
+
+LEAVE_INDEX_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS leave_interval USING rtree_i32(id, user_min, user_max, day_min, day_max)",
+    f"""CREATE TRIGGER IF NOT EXISTS leave_interval_ai AFTER INSERT ON leave_request WHEN {_ACTIVE} BEGIN
+        INSERT INTO leave_interval VALUES ({_ROW});
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS leave_interval_ad AFTER DELETE ON leave_request BEGIN
+        DELETE FROM leave_interval WHERE id = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS leave_interval_au AFTER UPDATE OF user_id, start_date, end_date, status ON leave_request BEGIN
+        DELETE FROM leave_interval WHERE id = old.id;
+        INSERT INTO leave_interval SELECT {_ROW} WHERE {_ACTIVE};
+    END""",
+]
+
+_state = {'ready': None}
+
+def ensure_leave_index(connection, rebuild=False):
+    """
+    Creates leave_interval and its triggers if they are missing, indexing the
+    existing active requests. Safe to run on every migration. rebuild
+    repopulates an existing leave_interval too, for when leave_request itself
+    was just created.
+    """
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'leave_interval'").first()
+    for ddl in LEAVE_INDEX_DDL:
+        connection.exec_driver_sql(ddl)
+    if exists and rebuild:
+        connection.exec_driver_sql("DELETE FROM leave_interval")
+    if rebuild or not exists:
+        connection.exec_driver_sql(
+            f"INSERT INTO leave_interval SELECT {_ROW.replace('new.', '')} FROM leave_request "
+            f"WHERE {_ACTIVE.replace('new.', '')}")
+    _state['ready'] = True
+
+def drop_leave_index(connection):
+    """
+    Drops leave_interval, which SQLite leaves behind when leave_request is
+    dropped (the triggers go with the table).
+    """
+    connection.exec_driver_sql("DROP TABLE IF EXISTS leave_interval")
+    _state['ready'] = None
+
+def leave_index_ready(db):
+    """
+    True once leave_interval exists in the database. Until a database has been
+    migrated, lookups fall back to plain range filters.
+    """
+    if not _state['ready']:
+        _state['ready'] = db.session.execute(db.text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'leave_interval'")).first() is not None
+    return _state['ready']
+
+def _epoch_day(day):
+    return day.toordinal() - 719163  # date(1970, 1, 1).toordinal()
+
+def leaves_overlapping(db, LeaveRequest, start, end, user_ids=None, statuses=ACTIVE_STATUSES):
+    """
+    Query of the leave requests with one of statuses (a subset of ACTIVE_STATUSES)
+    that cover any day of start..end, for the given users or everybody.
+    """
+    query = LeaveRequest.query.filter(LeaveRequest.status.in_(statuses))
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return query.filter(db.false())
+    if not leave_index_ready(db):
+        query = query.filter(LeaveRequest.start_date <= end, LeaveRequest.end_date >= start)
+        return query.filter(LeaveRequest.user_id.in_(user_ids)) if user_ids is not None else query
+
+    box = db.table('leave_interval', *(db.column(c, db.Integer) for c in ('id', 'user_min', 'user_max', 'day_min', 'day_max')))
+    hits = db.select(box.c.id).where(box.c.day_min <= _epoch_day(end), box.c.day_max >= _epoch_day(start))
+    if user_ids is not None:
+        # The box narrows the tree search; the exact user filter is applied on the join
+        hits = hits.where(box.c.user_min <= max(user_ids), box.c.user_max >= min(user_ids))
+        query = query.filter(LeaveRequest.user_id.in_(user_ids))
+    return query.filter(LeaveRequest.id.in_(hits))
+
+def find_overlap(db, LeaveRequest, user_id, start, end):
+    """
+    The employee's first pending or approved leave request that shares a day with
+    start..end, or None.
+    """
+    return leaves_overlapping(db, LeaveRequest, start, end, user_ids=[user_id]) \
+        .order_by(LeaveRequest.start_date).first()
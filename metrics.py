@@ -0,0 +1,209 @@
+import os
+import time
+import random
+import cProfile
+import threading
+from collections import defaultdict
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+
+# Opt-in request instrumentation (METRICS_ENABLED=1). Per-endpoint latency, SQL
+# statement counts and time, template render time and outbound mail time are
+# kept in memory per process and exposed in Prometheus text format; with
+# several workers every process reports its own numbers. Optionally a sample of
+# requests runs under cProfile and the slow ones are dumped to disk.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+class _RequestState:
+    __slots__ = ('started', 'sql_statements', 'sql_seconds', 'profile', 'status')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.profile = None
+        self.status = 500
+
+def _labels(**labels):
+    if not labels:
+        return ''
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels.items()) + '}'
+
+class RequestMetrics:
+    """
+    Collects the numbers once init_app has hooked a Flask app and an SQLAlchemy engine.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))        # (endpoint, method)
+        self.requests = defaultdict(int)                                      # (endpoint, method, status)
+        self.sql_per_request = defaultdict(lambda: Histogram(STATEMENT_BUCKETS)) # endpoint
+        self.sql_statements = defaultdict(int)                                # endpoint ('' outside requests)
+        self.sql_seconds = defaultdict(float)
+        self.templates = defaultdict(lambda: Histogram(LATENCY_BUCKETS))      # template name
+        self.mail = Histogram(LATENCY_BUCKETS)                                # one observation per SMTP batch
+        self.mail_messages = defaultdict(int)                                 # 'sent' / 'failed'
+        self.profiles_dumped = 0
+        self.profile_dir = None
+        self.profile_sample_rate = 0.0
+        self.profile_slow_seconds = None
+
+    def init_app(self, app, engine):
+        self.profile_dir = app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+        self.profile_sample_rate = float(app.config.get('PROFILE_SAMPLE_RATE', 0))
+        slow_ms = app.config.get('PROFILE_SLOW_MS')
+        self.profile_slow_seconds = float(slow_ms) / 1000 if slow_ms else None
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._before_render, app, weak=False)
+        template_rendered.connect(self._after_render, app, weak=False)
+        event.listen(engine, 'before_cursor_execute', self._before_cursor)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor)
+
+    # Requests
+    def _before_request(self):
+        state = g._metrics = _RequestState()
+        if self.profile_slow_seconds is not None and random.random() < self.profile_sample_rate:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                state.profile = profile
+            except ValueError:
+                pass # another profiler is already active in this thread
+
+    def _after_request(self, response):
+        state = g.get('_metrics')
+        if state is not None:
+            state.status = response.status_code
+        return response
+
+    def _teardown_request(self, exc):
+        # Runs when the request context is popped, which for stream_with_context
+        # responses (the payslip ZIP) is after the last chunk has been sent
+        state = g.pop('_metrics', None)
+        if state is None:
+            return
+        elapsed = time.perf_counter() - state.started
+        if state.profile:
+            state.profile.disable()
+        endpoint, method = request.endpoint or 'unmatched', request.method
+        with self._lock:
+            self.latency[(endpoint, method)].observe(elapsed)
+            self.requests[(endpoint, method, state.status)] += 1
+            self.sql_per_request[endpoint].observe(state.sql_statements)
+            self.sql_statements[endpoint] += state.sql_statements
+            self.sql_seconds[endpoint] += state.sql_seconds
+        if state.profile and elapsed >= self.profile_slow_seconds:
+            self._dump_profile(state.profile, endpoint, elapsed)
+
+    def _dump_profile(self, profile, endpoint, elapsed):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}_{endpoint}_{int(elapsed * 1000)}ms_{os.getpid()}.prof"
+        try:
+            profile.dump_stats(os.path.join(self.profile_dir, name))
+        except OSError as e:
+            print(f"Profile dump failed: {e}")
+            return
+        with self._lock:
+            self.profiles_dumped += 1
+
+    # SQL
+    def _before_cursor(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    def _after_cursor(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('metrics_started')
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        state = g.get('_metrics') if has_request_context() else None
+        if state is not None:
+            state.sql_statements += 1
+            state.sql_seconds += elapsed
+        else:
+            # Background work: the outbox worker, CLI commands
+            with self._lock:
+                self.sql_statements[''] += 1
+                self.sql_seconds[''] += elapsed
+
+    # Templates
+    def _before_render(self, sender, template, context, **extra):
+        if has_request_context():
+            g.setdefault('_metrics_render_started', []).append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        started = g.get('_metrics_render_started') if has_request_context() else None
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        with self._lock:
+            self.templates[template.name or 'string'].observe(elapsed)
+
+    # Mail (outbox.batch_sent)
+    def observe_mail_batch(self, sender, seconds, sent, failed, **extra):
+        with self._lock:
+            self.mail.observe(seconds)
+            self.mail_messages['sent'] += sent
+            self.mail_messages['failed'] += failed
+
+    # Exposition
+    def render(self):
+        """
+        All metrics in Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        def histogram(name, help_text, series):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, h in series:
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {h.count}")
+                lines.append(f"{name}_sum{_labels(**labels)} {h.sum:.6f}")
+                lines.append(f"{name}_count{_labels(**labels)} {h.count}")
+        def counter(name, help_text, series, fmt='{}'):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series:
+                lines.append(f"{name}{_labels(**labels)} {fmt.format(value)}")
+
+        with self._lock:
+            histogram('hr_request_duration_seconds', 'Request latency, including streaming the response body.',
+                      [({'endpoint': e, 'method': m}, h) for (e, m), h in sorted(self.latency.items())])
+            counter('hr_requests_total', 'Requests by endpoint, method and status.',
+                    [({'endpoint': e, 'method': m, 'status': s}, v) for (e, m, s), v in sorted(self.requests.items())])
+            histogram('hr_request_sql_statements', 'SQL statements executed per request.',
+                      [({'endpoint': e}, h) for e, h in sorted(self.sql_per_request.items())])
+            counter('hr_sql_statements_total', 'SQL statements executed; endpoint="" is background work.',
+                    [({'endpoint': e}, v) for e, v in sorted(self.sql_statements.items())])
+            counter('hr_sql_seconds_total', 'Time spent executing SQL; endpoint="" is background work.',
+                    [({'endpoint': e}, v) for e, v in sorted(self.sql_seconds.items())], '{:.6f}')
+            histogram('hr_template_render_seconds', 'Jinja template render time.',
+                      [({'template': t}, h) for t, h in sorted(self.templates.items())])
+            histogram('hr_mail_batch_seconds', 'Time to send one outbox batch over SMTP.', [({}, self.mail)])
+            counter('hr_mail_messages_total', 'Outbound emails by result.',
+                    [({'result': r}, v) for r, v in sorted(self.mail_messages.items())])
+            counter('hr_profiles_dumped_total', 'Slow sampled requests written to the profile directory.',
+                    [({}, self.profiles_dumped)])
+        return '\n'.join(lines) + '\n'
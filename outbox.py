@@ -0,0 +1,138 @@
+import smtplib
+import threading
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from blinker import Namespace
+from flask_mail import Message
+
+# Outbound email is written to the OutboxEmail table by the routes and sent
+# from here, in batches over a single SMTP connection, so no request waits on SMTP.
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 5
+BASE_BACKOFF_SECONDS = 30
+MAX_BACKOFF_SECONDS = 3600
+STALE_CLAIM_SECONDS = 600
+POLL_INTERVAL_SECONDS = 2.0
+# Refusals of a single message. Checked before OSError, which every
+# SMTPException subclasses, since only a dropped connection ends the batch.
+MESSAGE_REFUSED = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+# Sent after every batch with seconds (time spent on SMTP), sent and failed counts
+batch_sent = Namespace().signal('outbox-batch-sent')
+
+_worker = {'thread': None, 'pid': None, 'wakeup': threading.Event()}
+
+def backoff_delay(attempts):
+    """
+    Seconds to wait before the next try after the given number of failed attempts.
+    """
+    return min(BASE_BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+
+def _claim_batch(db, OutboxEmail, batch_size):
+    now = datetime.utcnow()
+    ready = db.or_(
+        db.and_(OutboxEmail.status == 'Pending', OutboxEmail.next_attempt_at <= now),
+        # A worker died mid-batch; hand its messages to someone else
+        db.and_(OutboxEmail.status == 'Sending', OutboxEmail.claimed_at < now - timedelta(seconds=STALE_CLAIM_SECONDS)),
+    )
+    candidate_ids = db.session.query(OutboxEmail.id).filter(ready).order_by(OutboxEmail.id).limit(batch_size).scalar_subquery()
+    claim = uuid.uuid4().hex
+    # The status check is repeated in the UPDATE so two workers can never claim the same row
+    claimed = OutboxEmail.query.filter(OutboxEmail.id.in_(candidate_ids), ready).update(
+        {'status': 'Sending', 'claim': claim, 'claimed_at': now}, synchronize_session=False)
+    db.session.commit()
+    if not claimed:
+        return []
+    return OutboxEmail.query.filter_by(claim=claim).order_by(OutboxEmail.id).all()
+
+def _to_message(row):
+    msg = Message(row.subject, recipients=[r for r in row.recipients.split(',') if r])
+    msg.body = row.body
+    msg.html = row.html
+    return msg
+
+def _record_failure(row, error):
+    row.attempts += 1
+    row.last_error = str(error)[:500]
+    row.claim = None
+    if row.attempts >= MAX_ATTEMPTS:
+        row.status = 'Failed'
+    else:
+        row.status = 'Pending'
+        row.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff_delay(row.attempts))
+
+def drain_outbox(db, OutboxEmail, mail, batch_size=BATCH_SIZE):
+    """
+    Sends one batch of due emails over a single SMTP connection.
+    Returns the number of messages claimed (sent or rescheduled).
+    """
+    rows = _claim_batch(db, OutboxEmail, batch_size)
+    if not rows:
+        return 0
+
+    remaining = list(rows)
+    failed = 0
+    started = time.perf_counter()
+    try:
+        with mail.connect() as conn:
+            while remaining:
+                row = remaining[0]
+                try:
+                    conn.send(_to_message(row))
+                except MESSAGE_REFUSED as e:
+                    # This message was refused; smtplib has reset the session
+                    # and the connection is still usable
+                    _record_failure(row, e)
+                    failed += 1
+                except (smtplib.SMTPServerDisconnected, OSError):
+                    # Includes every other SMTPException (a subclass of OSError)
+                    raise
+                except Exception as e:
+                    # Could not build the message (bad address, encoding); only this row is affected
+                    _record_failure(row, e)
+                    failed += 1
+                else:
+                    db.session.delete(row)
+                remaining.pop(0)
+    except Exception as e:
+        # Could not connect, or the connection dropped: retry the rest later
+        print(f"Outbox SMTP error: {e}")
+        for row in remaining:
+            _record_failure(row, e)
+        failed += len(remaining)
+    elapsed = time.perf_counter() - started
+    db.session.commit()
+    batch_sent.send(mail, seconds=elapsed, sent=len(rows) - failed, failed=failed)
+    return len(rows)
+
+def run_worker(app, db, OutboxEmail, mail, stop_event=None, poll_interval=POLL_INTERVAL_SECONDS):
+    """
+    Drains the outbox until stop_event is set, sleeping while there is nothing due.
+    """
+    stop_event = stop_event or threading.Event()
+    wakeup = _worker['wakeup']
+    while not stop_event.is_set():
+        processed = 0
+        try:
+            with app.app_context():
+                processed = drain_outbox(db, OutboxEmail, mail)
+        except Exception as e:
+            print(f"Outbox worker error: {e}")
+        if not processed:
+            wakeup.wait(poll_interval)
+            wakeup.clear()
+
+def ensure_worker_thread(app, db, OutboxEmail, mail):
+    """
+    Starts the background sender thread for this process, once (and again after a fork).
+    """
+    thread = _worker['thread']
+    if thread and thread.is_alive() and _worker['pid'] == os.getpid():
+        _worker['wakeup'].set()
+        return
+    thread = threading.Thread(target=run_worker, args=(app, db, OutboxEmail, mail), name='outbox-worker', daemon=True)
+    _worker['thread'] = thread
+    _worker['pid'] = os.getpid()
+    thread.start()
@@ -0,0 +1,134 @@
+import os
+import threading
+from functools import lru_cache
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Password hashing and verification run in a small pool of worker processes
+# instead of the request thread, so a burst of logins (scrypt is ~100 ms of CPU
+# each) can only ever use PASSWORD_HASH_WORKERS cores and the rest of the web
+# worker keeps serving. At most max_pending hashes are queued or running at
+# once; past that, callers wait up to wait_seconds for a slot and then get
+# HashingBusy, which the app turns into a 503. Hashes made with older
+# parameters are replaced on the next successful login.
+BULK_CHUNK = 8 # passwords per task for bulk hashing, so logins queued behind an import wait for one chunk at most
+
+class HashingBusy(RuntimeError):
+    """Too many passwords are being hashed already; try again shortly."""
+
+@lru_cache(maxsize=None)
+def hash_parameters(method):
+    """
+    The parameter prefix Werkzeug writes for method, e.g. 'scrypt' ->
+    'scrypt:32768:8:1', with its defaults filled in. Computed once per process.
+    """
+    return generate_password_hash('', method).split('$', 1)[0]
+
+def hash_password(password, method):
+    return generate_password_hash(password, method)
+
+def hash_passwords(passwords, method):
+    return [generate_password_hash(p, method) for p in passwords]
+
+def verify_password(password_hash, password, method):
+    """
+    (matches, new_hash): new_hash is set when the password matched but was
+    hashed with parameters other than method's. Runs inside a pool worker.
+    """
+    if not password_hash or not check_password_hash(password_hash, password):
+        return False, None
+    if password_hash.split('$', 1)[0] != hash_parameters(method):
+        return True, generate_password_hash(password, method)
+    return True, None
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords in a shared process pool. With workers=0 the
+    work runs in the calling thread, still under the max_pending limit.
+    """
+    def __init__(self, method='scrypt', workers=None, max_pending=None, wait_seconds=5.0):
+        self.configure(method, workers, max_pending, wait_seconds)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def configure(self, method='scrypt', workers=None, max_pending=None, wait_seconds=5.0):
+        self.method = method
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_pending = max_pending or 4 * max(self.workers, 1)
+        self.wait_seconds = wait_seconds
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    def init_app(self, app):
+        self.configure(app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_HASH_WORKERS'],
+                       app.config['PASSWORD_HASH_MAX_PENDING'], app.config['PASSWORD_HASH_WAIT_SECONDS'])
+
+    def _pool(self):
+        """
+        The process pool, started on first use (or after it broke). Workers are
+        spawned rather than forked, like the payslip PDF pool.
+        """
+        with self._lock:
+            if self._executor is None or getattr(self._executor, '_broken', False):
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.wait_seconds):
+            raise HashingBusy("Too many password checks in progress.")
+        try:
+            if not self.workers:
+                return fn(*args)
+            from concurrent.futures.process import BrokenProcessPool
+            try:
+                return self._pool().submit(fn, *args).result()
+            except BrokenProcessPool:
+                # A worker died (OOM kill etc.); the pool is rebuilt on next use
+                return fn(*args)
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(hash_password, password, self.method)
+
+    def verify(self, password_hash, password):
+        """(matches, new_hash); see verify_password."""
+        return self._run(verify_password, password_hash, password, self.method)
+
+    def hash_many(self, passwords):
+        """
+        Hashes for a bulk import, in order. Chunks go to the pool one slot at a
+        time with at most one chunk per worker in flight, so logins are
+        interleaved rather than queued behind the whole import.
+        """
+        from concurrent.futures import wait, FIRST_COMPLETED
+        passwords = list(passwords)
+        chunks = [passwords[i:i + BULK_CHUNK] for i in range(0, len(passwords), BULK_CHUNK)]
+        if len(chunks) <= 1 or not self.workers:
+            return [h for chunk in chunks for h in self._run(hash_passwords, chunk, self.method)]
+        results, in_flight = [None] * len(chunks), {}
+        pending = iter(enumerate(chunks))
+        try:
+            for index, chunk in pending:
+                if not self._slots.acquire(timeout=self.wait_seconds):
+                    raise HashingBusy("Too many password checks in progress.")
+                future = self._pool().submit(hash_passwords, chunk, self.method)
+                future.add_done_callback(lambda _: self._slots.release())
+                in_flight[future] = index
+                if len(in_flight) >= self.workers:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results[in_flight.pop(future)] = future.result()
+            for future in list(in_flight):
+                results[in_flight.pop(future)] = future.result()
+        finally:
+            for future in in_flight:
+                future.cancel()
+        return [h for chunk in results for h in chunk]
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -1,30 +1,142 @@
-import pandas as pd
-from datetime import date
+import time
+from collections import namedtuple
+from datetime import date, timedelta
 from calendar import monthrange
-def calculate_payslip(employee, year, month, db, Holiday, LeaveRequest):
+from leave_intervals import leaves_overlapping
+
+# numpy is imported inside the functions that use it, so importing this module
+# (and app) does not pay for it until the first payroll or calendar computation.
+
+# Business-day calendar per (year, month). Holidays are loaded once per month
+# and kept for CALENDAR_TTL seconds so other workers pick up edits eventually;
+# the worker that writes a Holiday invalidates its own copy immediately.
+CALENDAR_TTL = 300
+LEAVE_LOOKUP_MAX_IDS = 500 # above this, load the whole month's leaves rather than bind every id
+MonthCalendar = namedtuple('MonthCalendar', 'year month start end days weekdays workdays payable_days holidays')
+_calendar_cache = {}
+
+def get_month_calendar(year, month, Holiday):
     """
-    Calculates the payslip for a given employee for a specific month and year.
+    Returns the cached business-day calendar for a month, building it on first use.
     """
+    import numpy as np
+    key = (year, month)
+    cached = _calendar_cache.get(key)
+    if cached and time.monotonic() - cached[0] < CALENDAR_TTL:
+        return cached[1]
+
     start_of_month = date(year, month, 1)
     days_in_month = monthrange(year, month)[1]
     end_of_month = date(year, month, days_in_month)
-    month_dates = pd.date_range(start_of_month, end_of_month)
-
-    
     holidays_query = Holiday.query.filter(
-        db.extract('year', Holiday.date) == year,
-        db.extract('month', Holiday.date) == month
+        Holiday.date >= start_of_month,
+        Holiday.date <= end_of_month
     ).all()
-    public_holidays = [h.date for h in holidays_query]
-    payable_days_count = 0
-    for day in month_dates:
-        if day.weekday() != 6 and day.date() not in public_holidays:
-            payable_days_count += 1
-        
+    public_holidays = frozenset(h.date for h in holidays_query)
+
+    weekdays = (np.arange(days_in_month) + start_of_month.weekday()) % 7
+    workdays = weekdays != 6
+    for h in public_holidays:
+        workdays[h.day - 1] = False
+    weekdays.flags.writeable = False
+    workdays.flags.writeable = False
+
+    calendar = MonthCalendar(year, month, start_of_month, end_of_month, days_in_month,
+                             weekdays, workdays, int(workdays.sum()), public_holidays)
+    _calendar_cache[key] = (time.monotonic(), calendar)
+    return calendar
+
+def invalidate_month_calendar(day=None):
+    """
+    Drops the cached calendar for the month containing day, or every month if day is None.
+    """
+    if day is None:
+        _calendar_cache.clear()
+    else:
+        _calendar_cache.pop((day.year, day.month), None)
+
+def iter_months(start, end):
+    """
+    Yields (year, month) for every month touched by the inclusive range start..end.
+    """
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+def sundays_between(start, end, Holiday):
+    """
+    Returns the Sundays in the inclusive range start..end using the month calendars.
+    """
+    import numpy as np
+    sundays = []
+    for year, month in iter_months(start, end):
+        calendar = get_month_calendar(year, month, Holiday)
+        for offset in np.flatnonzero(calendar.weekdays == 6):
+            day = calendar.start + timedelta(days=int(offset))
+            if start <= day <= end:
+                sundays.append(day)
+    return sundays
+
+def business_days_between(start, end, Holiday):
+    """
+    Returns the working days (not Sundays or public holidays) in the inclusive range start..end.
+    """
+    import numpy as np
+    days = []
+    for year, month in iter_months(start, end):
+        calendar = get_month_calendar(year, month, Holiday)
+        for offset in np.flatnonzero(calendar.workdays):
+            day = calendar.start + timedelta(days=int(offset))
+            if start <= day <= end:
+                days.append(day)
+    return days
+
+def _leave_day_counts(positions, leaves, first_day, last_day):
+    """
+    Per-employee, per-day count of leaves covering each day of first_day..last_day,
+    built with a difference array so each leave costs O(1) regardless of length.
+    """
+    import numpy as np
+    n_days = (last_day - first_day).days + 1
+    counts = np.zeros((len(positions), n_days + 1), dtype=np.int64)
+    leaves = [l for l in leaves if l.start_date <= last_day and l.end_date >= first_day]
+    if leaves:
+        rows = np.fromiter((positions[l.user_id] for l in leaves), dtype=np.int64, count=len(leaves))
+        starts = np.fromiter((max((l.start_date - first_day).days, 0) for l in leaves), dtype=np.int64, count=len(leaves))
+        ends = np.fromiter((min((l.end_date - first_day).days, n_days - 1) for l in leaves), dtype=np.int64, count=len(leaves))
+        np.add.at(counts, (rows, starts), 1)
+        np.add.at(counts, (rows, ends + 1), -1)
+    return np.cumsum(counts, axis=1)[:, :n_days]
+
+def calculate_payslip(employee, year, month, db, Holiday, LeaveRequest):
+    """
+    Calculates the payslip for a given employee for a specific month and year.
+    """
+    return calculate_payslips([employee], year, month, db, Holiday, LeaveRequest)[0]
+
+def calculate_payslips(employees, year, month, db, Holiday, LeaveRequest):
+    """
+    Calculates payslips for many employees at once for a specific month and year.
+    Holidays and approved leaves are loaded with one query each and the day
+    counting is done with array operations. Returns one dict per employee, in
+    the same order and with the same keys as calculate_payslip.
+    """
+    import numpy as np
+    employees = list(employees)
+    calendar = get_month_calendar(year, month, Holiday)
+    start_of_month, end_of_month, days_in_month = calendar.start, calendar.end, calendar.days
+    month_year = start_of_month.strftime("%B %Y")
+    if not employees:
+        return []
+
+    workdays = calendar.workdays
+    payable_days_count = calendar.payable_days
+
     if payable_days_count == 0:
-        return {
+        return [{
             "employee_name": employee.name,
-            "month_year": start_of_month.strftime("%B %Y"),
+            "month_year": month_year,
             "gross_salary": employee.salary,
             "total_payable_days": 0,
             "per_day_salary": 0,
@@ -32,37 +144,130 @@ def calculate_payslip(employee, year, month, db, Holiday, LeaveRequest):
             "deductions": 0,
             "net_salary": 0,
             "error": "No payable days in this month."
-        }
+        } for employee in employees]
 
-    per_day_salary = employee.salary / payable_days_count
-    approved_leaves_query = LeaveRequest.query.filter(
-        LeaveRequest.user_id == employee.id,
-        LeaveRequest.status == 'Approved'
+    # Only leaves overlapping the month matter; one interval-index query for everybody.
+    positions = {employee.id: i for i, employee in enumerate(employees)}
+    approved_leaves_query = leaves_overlapping(
+        db, LeaveRequest, start_of_month, end_of_month, statuses=('Approved',),
+        user_ids=positions if len(positions) <= LEAVE_LOOKUP_MAX_IDS else None
     ).all()
-    
-    deductible_leave_days = 0
-    leave_dates_list = []
-    for leave in approved_leaves_query:
-        leave_dates = pd.date_range(leave.start_date, leave.end_date)
-        for leave_day in leave_dates:
-            if leave_day.month == month and leave_day.year == year:
-                if leave_day.weekday() != 6 and leave_day.date() not in public_holidays:
-                    deductible_leave_days += 1
-                    leave_dates_list.append(leave_day.strftime('%d-%b'))
 
+    leaves = [l for l in approved_leaves_query if l.user_id in positions]
+
+    leave_counts = _leave_day_counts(positions, leaves, start_of_month, end_of_month) * workdays
+
+    salaries = np.array([employee.salary for employee in employees], dtype=np.float64)
+    per_day_salary = salaries / payable_days_count
+    deductible_leave_days = leave_counts.sum(axis=1)
     deductions = deductible_leave_days * per_day_salary
-    net_salary = employee.salary - deductions
+    net_salary = salaries - deductions
+
+    day_labels = np.array([(start_of_month + timedelta(days=i)).strftime('%d-%b') for i in range(days_in_month)])
+    payslips = []
+    for i, employee in enumerate(employees):
+        leave_dates_list = []
+        if deductible_leave_days[i]:
+            leave_dates_list = day_labels.repeat(leave_counts[i]).tolist()
+        payslips.append({
+            "employee_name": employee.name,
+            "month_year": month_year,
+            "gross_salary": employee.salary,
+            "total_payable_days": payable_days_count,
+            "per_day_salary": float(per_day_salary[i]),
+            "deductible_leave_days": int(deductible_leave_days[i]),
+            "leave_dates": leave_dates_list,
+            "deductions": float(deductions[i]),
+            "net_salary": float(net_salary[i])
+        })
+
+    return payslips
+
+def period_label(start, end):
+    """
+    Human readable name of the window start..end.
+    """
+    if start == end:
+        return start.strftime("%d %B %Y")
+    if (start.day, end) == (1, date(start.year, start.month, monthrange(start.year, start.month)[1])):
+        return start.strftime("%B %Y")
+    return f"{start.strftime('%d %b %Y')} - {end.strftime('%d %b %Y')}"
+
+def calculate_period_payslips(employees, start, end, db, Holiday, LeaveRequest):
+    """
+    Calculates payslips for many employees over an arbitrary window start..end
+    (inclusive). Every working day in the window is paid at its own month's
+    per-day rate (monthly salary / that month's payable days), so a week that
+    spans two months uses both rates and a whole month gives the same figures as
+    calculate_payslips. Work is done one month at a time with array operations
+    across all employees. Employees need id, name and salary. Returns one dict
+    per employee with the same keys as calculate_payslip; total_payable_days and
+    per_day_salary describe the window.
+    """
+    import numpy as np
+    employees = list(employees)
+    if not employees:
+        return []
+    label = period_label(start, end)
+    positions = {employee.id: i for i, employee in enumerate(employees)}
+    salaries = np.array([employee.salary for employee in employees], dtype=np.float64)
+
+    approved_leaves_query = leaves_overlapping(
+        db, LeaveRequest, start, end, statuses=('Approved',),
+        user_ids=positions if len(positions) <= LEAVE_LOOKUP_MAX_IDS else None
+    ).all()
+    leaves = [l for l in approved_leaves_query if l.user_id in positions]
+
+    gross = np.zeros(len(employees))
+    deductions = np.zeros(len(employees))
+    leave_days = np.zeros(len(employees), dtype=np.int64)
+    leave_dates = [[] for _ in employees]
+    payable_days_count = 0
+    for year, month in iter_months(start, end):
+        calendar = get_month_calendar(year, month, Holiday)
+        lo, hi = max(start, calendar.start), min(end, calendar.end)
+        first = (lo - calendar.start).days
+        workdays = calendar.workdays[first:first + (hi - lo).days + 1]
+        window_payable = int(workdays.sum())
+        if not window_payable:
+            continue
+        payable_days_count += window_payable
+        per_day = salaries / calendar.payable_days
+        # A whole month is paid exactly, without rounding through the per-day rate
+        gross += salaries if window_payable == calendar.payable_days else per_day * window_payable
+
+        counts = _leave_day_counts(positions, leaves, lo, hi) * workdays
+        month_leave_days = counts.sum(axis=1)
+        leave_days += month_leave_days
+        deductions += month_leave_days * per_day
+        if month_leave_days.any():
+            day_labels = np.array([(lo + timedelta(days=i)).strftime('%d-%b') for i in range(len(workdays))])
+            for i in np.flatnonzero(month_leave_days):
+                leave_dates[i].extend(day_labels.repeat(counts[i]).tolist())
+
+    if payable_days_count == 0:
+        return [{
+            "employee_name": employee.name,
+            "month_year": label,
+            "gross_salary": 0,
+            "total_payable_days": 0,
+            "per_day_salary": 0,
+            "deductible_leave_days": 0,
+            "deductions": 0,
+            "net_salary": 0,
+            "error": "No payable days in this period."
+        } for employee in employees]
 
-    payslip_data = {
+    net_salary = gross - deductions
+    per_day_salary = gross / payable_days_count
+    return [{
         "employee_name": employee.name,
-        "month_year": start_of_month.strftime("%B %Y"),
-        "gross_salary": employee.salary,
+        "month_year": label,
+        "gross_salary": float(gross[i]),
         "total_payable_days": payable_days_count,
-        "per_day_salary": per_day_salary,
-        "deductible_leave_days": deductible_leave_days,
-        "leave_dates": leave_dates_list,
-        "deductions": deductions,
-        "net_salary": net_salary
-    }
-    
-    return payslip_data
\ No newline at end of file
+        "per_day_salary": float(per_day_salary[i]),
+        "deductible_leave_days": int(leave_days[i]),
+        "leave_dates": leave_dates[i],
+        "deductions": float(deductions[i]),
+        "net_salary": float(net_salary[i])
+    } for i, employee in enumerate(employees)]
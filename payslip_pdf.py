@@ -0,0 +1,192 @@
+import os
+import json
+import hashlib
+import threading
+import zipfile
+from concurrent.futures import wait, FIRST_COMPLETED, ALL_COMPLETED
+
+# Bulk payslip PDFs are rendered by WeasyPrint in a pool of worker processes
+# and written into a ZIP that is streamed to the client while rendering goes on.
+# multiprocessing and the process pool are imported when the pool is first needed.
+_pool = {'executor': None, 'workers': None}
+
+def weasyprint_available():
+    """
+    True if WeasyPrint and its native libraries can be loaded.
+    """
+    try:
+        import weasyprint  # noqa: F401
+        return True
+    except (ImportError, OSError):
+        return False
+
+def html_to_pdf(html):
+    """
+    Renders one HTML document to PDF bytes. Runs inside a pool worker.
+    """
+    from weasyprint import HTML
+    return HTML(string=html).write_pdf()
+
+def get_pdf_pool(max_workers=None):
+    """
+    Returns the shared process pool, creating it on first use (or after it broke).
+    Workers are spawned rather than forked so they never inherit the web
+    worker's threads or database connections.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    max_workers = max_workers or os.cpu_count() or 1
+    executor = _pool['executor']
+    if executor is None or _pool['workers'] != max_workers or getattr(executor, '_broken', False):
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+        _pool['executor'] = executor
+        _pool['workers'] = max_workers
+    return executor
+
+def _collect(in_flight, return_when):
+    done, _ = wait(in_flight, return_when=return_when)
+    for future in done:
+        yield in_flight.pop(future), future.result()
+
+def render_pdfs(documents, max_workers=None, cache=None):
+    """
+    Renders (filename, cache_key, render_html) documents in parallel and yields
+    (filename, pdf_bytes) as each one finishes. render_html is only called for
+    documents missing from the cache. At most two documents per worker are in
+    flight, so memory stays bounded however many documents there are.
+    """
+    from concurrent.futures.process import BrokenProcessPool
+    pool = get_pdf_pool(max_workers)
+    window = 2 * _pool['workers']
+    in_flight = {}
+    try:
+        for filename, key, render_html in documents:
+            pdf = cache.get(key) if cache else None
+            if pdf is not None:
+                yield filename, pdf
+                continue
+            in_flight[pool.submit(html_to_pdf, render_html())] = (filename, key)
+            if len(in_flight) >= window:
+                yield from _store(_collect(in_flight, FIRST_COMPLETED), cache)
+        while in_flight:
+            yield from _store(_collect(in_flight, ALL_COMPLETED), cache)
+    except BrokenProcessPool:
+        _pool['executor'] = None
+        raise
+    finally:
+        # Client went away or rendering failed: don't leave work queued
+        for future in in_flight:
+            future.cancel()
+
+def _store(results, cache):
+    for (filename, key), pdf in results:
+        if cache: cache.put(key, pdf)
+        yield filename, pdf
+
+def cache_key(*parts):
+    """
+    Content address for a document: a hash of everything that goes into it.
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+class PdfCache:
+    """
+    Rendered PDFs stored on disk under their cache_key. Reads refresh the file's
+    mtime and the least recently used files are evicted once the directory grows
+    past max_bytes. Hit/miss counters are per process.
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.counters = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._size = None  # bytes on disk, scanned on first store
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.pdf')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            with self._lock: self.counters['misses'] += 1
+            return None
+        with self._lock: self.counters['hits'] += 1
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.counters['stores'] += 1
+            self._size = self._disk_usage()[0] if self._size is None else self._size + len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _disk_usage(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.pdf'): continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return sum(size for _, size, _ in entries), entries
+
+    def _evict(self):
+        # Free down to 90% so the directory isn't rescanned on every store
+        total, entries = self._disk_usage()
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes * 0.9: break
+            try:
+                os.remove(path)
+                self.counters['evictions'] += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, bytes=self._size, max_bytes=self.max_bytes)
+
+class _ChunkBuffer:
+    """Write-only file object that hands out whatever was written since the last drain."""
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def stream_zip(entries):
+    """
+    Yields a ZIP archive chunk by chunk from (filename, bytes) pairs. Each entry
+    is sent as soon as it is written; nothing but the central directory is kept.
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for filename, data in entries:
+            zip_file.writestr(filename, data)
+            yield buffer.drain()
+    yield buffer.drain()
@@ -0,0 +1,123 @@
+import re
+
+# Employee search over an FTS5 index of User name, employee_id, email and phone.
+# user_fts is an external-content table: it stores only the index and reads the
+# text back from `user`, and triggers on `user` keep it in sync with every
+# write, including bulk SQL that bypasses the ORM. Terms match word prefixes,
+# so "jo sm" finds "John Smith" and "emp00" finds "EMP0042".
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MIN_CHARS = 2
+AUTOCOMPLETE_CANDIDATES = 200 # matches ranked per request; short prefixes can match everybody
+
+SEARCH_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS user_fts USING fts5(
+        name, employee_id, email, phone_number,
+        content='user', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS user_fts_ai AFTER INSERT ON user BEGIN
+        INSERT INTO user_fts(rowid, name, employee_id, email, phone_number)
+        VALUES (new.id, new.name, new.employee_id, new.email, new.phone_number);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS user_fts_ad AFTER DELETE ON user BEGIN
+        INSERT INTO user_fts(user_fts, rowid, name, employee_id, email, phone_number)
+        VALUES ('delete', old.id, old.name, old.employee_id, old.email, old.phone_number);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS user_fts_au AFTER UPDATE OF name, employee_id, email, phone_number ON user BEGIN
+        INSERT INTO user_fts(user_fts, rowid, name, employee_id, email, phone_number)
+        VALUES ('delete', old.id, old.name, old.employee_id, old.email, old.phone_number);
+        INSERT INTO user_fts(rowid, name, employee_id, email, phone_number)
+        VALUES (new.id, new.name, new.employee_id, new.email, new.phone_number);
+    END""",
+]
+
+_state = {'ready': None}
+
+def ensure_search_index(connection, rebuild=False):
+    """
+    Creates user_fts and its triggers if they are missing, indexing the existing
+    users. Safe to run on every migration. rebuild re-indexes an existing
+    user_fts too, for when `user` itself was just created.
+    """
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_fts'").first()
+    for ddl in SEARCH_INDEX_DDL:
+        connection.exec_driver_sql(ddl)
+    if rebuild or not exists:
+        connection.exec_driver_sql("INSERT INTO user_fts(user_fts) VALUES ('rebuild')")
+    _state['ready'] = True
+
+def drop_search_index(connection):
+    """
+    Drops user_fts, which SQLite leaves behind when `user` is dropped (the
+    triggers go with the table).
+    """
+    connection.exec_driver_sql("DROP TABLE IF EXISTS user_fts")
+    _state['ready'] = None
+
+def search_index_ready(db):
+    """
+    True once user_fts exists in the database. Until a database has been
+    migrated, searches fall back to LIKE.
+    """
+    if not _state['ready']:
+        _state['ready'] = db.session.execute(db.text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_fts'")).first() is not None
+    return _state['ready']
+
+def fts_query(text):
+    """
+    Turns free text into an FTS5 query that requires a prefix match of every word.
+    Returns None if the text has nothing searchable in it.
+    """
+    terms = re.findall(r'\w+', text.lower())
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def _matching_ids(db, match):
+    return db.text("SELECT rowid FROM user_fts WHERE user_fts MATCH :match") \
+             .bindparams(match=match).columns(db.column('rowid', db.Integer))
+
+def search_filter(db, User, text):
+    """
+    Filter expression for User queries matching text by name, employee ID, email
+    or phone number.
+    """
+    match = fts_query(text)
+    if match is None:
+        return db.false()
+    if not search_index_ready(db):
+        return db.or_(User.name.ilike(f'%{text}%'), User.employee_id.ilike(f'%{text}%'))
+    return User.id.in_(_matching_ids(db, match))
+
+def autocomplete(db, User, query, text, limit=AUTOCOMPLETE_LIMIT):
+    """
+    Up to limit users from query matching text, best first: employee ID prefix
+    matches (from the employee_id index), then name prefix matches, then by FTS
+    relevance. Full-text matches are scoped by query and ordered by bm25 in
+    SQLite; only the best AUTOCOMPLETE_CANDIDATES of them are loaded and ranked.
+    """
+    text = text.strip()
+    match = fts_query(text)
+    if match is None or len(text) < AUTOCOMPLETE_MIN_CHARS:
+        return []
+    prefix = text.upper()
+    results = query.filter(User.employee_id >= prefix, User.employee_id < prefix + '\U0010ffff') \
+                   .order_by(User.employee_id).limit(limit).all()
+    if len(results) >= limit:
+        return results
+    if not search_index_ready(db):
+        return results + query.filter(search_filter(db, User, text), User.id.notin_([u.id for u in results])) \
+                              .order_by(User.employee_id).limit(limit - len(results)).all()
+
+    # The caller's scope is applied inside the full-text query, so the
+    # candidates are the best matches the caller may see
+    user_fts = db.table('user_fts', db.column('rowid', db.Integer))
+    score = db.literal_column("bm25(user_fts, 5.0, 10.0, 2.0, 1.0)")
+    candidates = query.join(user_fts, user_fts.c.rowid == User.id) \
+                      .filter(db.text("user_fts MATCH :match").bindparams(match=match),
+                              User.id.notin_([u.id for u in results])) \
+                      .add_columns(score).order_by(score).limit(AUTOCOMPLETE_CANDIDATES).all()
+    name_prefix = text.lower()
+    candidates.sort(key=lambda row: (not row[0].name.lower().startswith(name_prefix), row[1], row[0].employee_id))
+    return results + [user for user, _ in candidates[:limit - len(results)]]
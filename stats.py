@@ -0,0 +1,52 @@
+from collections import Counter
+
+# Dashboard counters computed with GROUP BY queries over a filtered User query,
+# so a listing can render one page while its totals still cover everybody.
+
+def count_by_role(db, User, query):
+    """
+    {Role: count} for the users matched by query.
+    """
+    counts = Counter()
+    for role, count in query.with_entities(User.role, db.func.count(User.id)).group_by(User.role):
+        counts[role.capitalize()] += count
+    return dict(counts)
+
+def attendance_stats(db, User, Attendance, query, day):
+    """
+    Present/leave counts for the users matched by query on day. Users without an
+    attendance record for the day count as present.
+    """
+    total = query.count()
+    on_leave = query.join(Attendance, db.and_(Attendance.user_id == User.id, Attendance.date == day)) \
+                    .filter(Attendance.status != 'Present')
+    cat_leave_counts = count_by_role(db, User, on_leave)
+    leave = sum(cat_leave_counts.values())
+    return {'present': total - leave, 'leave': leave, 'cat_leave_counts': cat_leave_counts}
+
+def payroll_totals(db, User, PayrollLine, run_id, query):
+    """
+    Gross, deductions and net summed over the payroll lines of run_id for the
+    users matched by query, plus net salary per role.
+    """
+    rows = query.join(PayrollLine, db.and_(PayrollLine.user_id == User.id, PayrollLine.run_id == run_id)) \
+                .with_entities(User.role, db.func.sum(PayrollLine.gross_salary), db.func.sum(PayrollLine.deductions),
+                               db.func.sum(PayrollLine.net_salary)) \
+                .group_by(User.role)
+    return _totals((role, gross or 0, deductions or 0, net or 0) for role, gross, deductions, net in rows)
+
+def sum_payslips(employees, payslips):
+    """
+    The same totals as payroll_totals, for payslips computed in Python (employees need a role).
+    """
+    return _totals((employee.role, p['gross_salary'], p['deductions'], p['net_salary']) for employee, p in zip(employees, payslips))
+
+def _totals(rows):
+    totals = {'total_gross': 0, 'total_deductions': 0, 'total_net': 0, 'role_salary': Counter()}
+    for role, gross, deductions, net in rows:
+        totals['total_gross'] += gross
+        totals['total_deductions'] += deductions
+        totals['total_net'] += net
+        totals['role_salary'][role.capitalize()] += net
+    totals['role_salary'] = dict(totals['role_salary'])
+    return totals
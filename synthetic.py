@@ -0,0 +1,165 @@
+import random
+from datetime import date, timedelta
+
+# Synthetic organisation for load testing and benchmarks: HR staff, supervisors
+# and their teams, with holidays, leave requests, daily attendance and personal
+# tasks going back a number of years. Everything is derived from the seed, so
+# the same arguments always produce the same database. Rows are written with
+# executemany inserts in chunks, so 10k employees with a year of history (2.7M
+# attendance rows) take under a minute without holding it all in memory.
+CHUNK_ROWS = 20000
+PREFIXES = {'hr': 'HRS', 'supervisor': 'SUPS', 'employee': 'EMPS'} # distinct from hand-made IDs like HR001
+HR_RATIO = 100      # one HR user per this many employees
+TEAM_SIZE = 10      # employees per supervisor
+LEAVES_PER_YEAR = 8
+TASKS_PER_MONTH = 2
+LEAVE_LENGTHS = (1, 1, 1, 2, 2, 3, 5, 10) # working-day-ish lengths, mostly short
+SALARY_RANGES = {'hr': (45000, 120000), 'supervisor': (60000, 180000), 'employee': (18000, 95000)}
+
+FIRST_NAMES = ('Aarav', 'Aditi', 'Amit', 'Ananya', 'Arjun', 'Deepa', 'Divya', 'Farhan', 'Gaurav', 'Isha', 'Karan', 'Kavya',
+               'Manoj', 'Meera', 'Neha', 'Nikhil', 'Pooja', 'Priya', 'Rahul', 'Ravi', 'Riya', 'Rohan', 'Sanjay', 'Sara',
+               'Shreya', 'Siddharth', 'Sneha', 'Suresh', 'Tanvi', 'Varun', 'Vikram', 'Zoya')
+LAST_NAMES = ('Agarwal', 'Bhat', 'Chopra', 'Das', 'Desai', 'Fernandes', 'Gupta', 'Iyer', 'Jain', 'Joshi', 'Kapoor', 'Khan',
+              'Kumar', 'Mehta', 'Menon', 'Nair', 'Patel', 'Pillai', 'Rao', 'Reddy', 'Shah', 'Sharma', 'Singh', 'Verma')
+CITIES = ('Bangalore', 'Chennai', 'Hyderabad', 'Mumbai', 'Pune', 'Delhi', 'Kochi', 'Ahmedabad')
+TEAMS = ('Platform', 'Payments', 'Mobile', 'Data', 'Support', 'Sales', 'Finance', 'Operations')
+PROJECTS = ('Apollo', 'Borealis', 'Cascade', 'Delta', 'Ember', 'Fjord', 'Granite', 'Helix')
+LEAVE_REASONS = ('Family function', 'Medical appointment', 'Fever', 'Personal work', 'Travel', 'Wedding', 'Exam', 'Vacation')
+TASKS = ('Prepare weekly report', 'Client call', 'Code review', 'Team sync', 'Update documentation', 'Plan sprint',
+         'Interview candidate', 'Submit expense claims', 'Training session', 'Follow up on tickets')
+FIXED_HOLIDAYS = ((1, 26, 'Republic Day'), (5, 1, 'Labour Day'), (8, 15, 'Independence Day'), (10, 2, 'Gandhi Jayanti'),
+                  (12, 25, 'Christmas'))
+FESTIVALS = ('Holi', 'Eid al-Fitr', 'Ganesh Chaturthi', 'Diwali', 'Pongal', 'Onam')
+COMPANY_EVENTS = ('Annual Day', 'Offsite', 'Founders Day')
+
+def _chunked_insert(db, Model, rows):
+    for i in range(0, len(rows), CHUNK_ROWS):
+        db.session.execute(Model.__table__.insert(), rows[i:i + CHUNK_ROWS])
+
+def _holidays(rng, first_year, last_year, taken):
+    rows = []
+    for year in range(first_year, last_year + 1):
+        days = [(date(year, m, d), name, 'government') for m, d, name in FIXED_HOLIDAYS]
+        for name in FESTIVALS:
+            days.append((date(year, 1, 1) + timedelta(days=rng.randrange(365)), name, 'government'))
+        for name in COMPANY_EVENTS[:2]:
+            days.append((date(year, 1, 1) + timedelta(days=rng.randrange(365)), name, 'company_event'))
+        for day, name, kind in days:
+            if day not in taken:
+                taken.add(day)
+                rows.append({'date': day, 'name': name, 'type': kind})
+    return rows
+
+def _leave_history(rng, user_id, first_day, today, horizon):
+    """
+    Non-overlapping leave requests for one employee between first_day and
+    today + horizon: past ones mostly approved, recent and future ones partly pending.
+    """
+    leaves = []
+    day = first_day + timedelta(days=int(rng.expovariate(LEAVES_PER_YEAR / 365)))
+    while day <= today + timedelta(days=horizon):
+        end = day + timedelta(days=rng.choice(LEAVE_LENGTHS) - 1)
+        if day > today - timedelta(days=14):
+            status = rng.choices(('Pending', 'Approved', 'Declined'), (6, 3, 1))[0]
+        else:
+            status = rng.choices(('Approved', 'Declined'), (17, 3))[0]
+        leaves.append({
+            'user_id': user_id, 'start_date': day, 'end_date': end, 'status': status,
+            'reason': rng.choice(LEAVE_REASONS), 'team': rng.choice(TEAMS), 'project': rng.choice(PROJECTS),
+        })
+        day = end + timedelta(days=1 + int(rng.expovariate(LEAVES_PER_YEAR / 365)))
+    return leaves
+
+def generate_organisation(db, User, LeaveRequest, Attendance, Holiday, PersonalTask, employees, password_hash,
+                          years=2, seed=0, today=None, leave_horizon_days=60):
+    """
+    Adds a synthetic organisation of `employees` users (HR, supervisors and
+    their teams) with `years` of history up to today. All users get
+    password_hash, so hash the shared password once. Returns the number of rows
+    added per table. Refuses to run twice on the same database.
+    """
+    if employees < 3:
+        raise ValueError("An organisation needs at least 3 employees (HR, a supervisor and a team member).")
+    rng = random.Random(seed)
+    today = today or date.today()
+    history_start = today - timedelta(days=round(365.25 * years))
+    if User.query.filter(User.employee_id.like(PREFIXES['employee'] + '%')).first():
+        raise ValueError("The database already has a synthetic organisation.")
+
+    n_hr = max(1, employees // HR_RATIO)
+    n_supervisors = max(1, (employees - n_hr) // (TEAM_SIZE + 1))
+    roles = ['hr'] * n_hr + ['supervisor'] * n_supervisors + ['employee'] * (employees - n_hr - n_supervisors)
+
+    counters = dict.fromkeys(PREFIXES, 0)
+    user_rows = []
+    for i, role in enumerate(roles):
+        counters[role] += 1
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        low, high = SALARY_RANGES[role]
+        user_rows.append({
+            'employee_id': f"{PREFIXES[role]}{counters[role]:05d}",
+            'name': f"{first} {last}",
+            'email': f"{first.lower()}.{last.lower()}.{i}@example.com",
+            'phone_number': f"9{rng.randrange(10 ** 9):09d}",
+            'address': f"{rng.randrange(1, 400)} {rng.choice(LAST_NAMES)} Road, {rng.choice(CITIES)}",
+            # Some joined before the history starts, the rest spread over it
+            'date_of_joining': history_start + timedelta(days=rng.randrange(-3 * 365, max((today - history_start).days - 30, 1))),
+            'password_hash': password_hash,
+            'role': role,
+            'salary': float(round(rng.uniform(low, high), -2)),
+        })
+    # Supervisors first, so their ids can be written on their team members' rows
+    def insert_users(rows):
+        _chunked_insert(db, User, rows)
+        return dict(db.session.query(User.employee_id, User.id).filter(User.employee_id.like(PREFIXES[rows[0]['role']] + '%')))
+    ids = insert_users([u for u in user_rows if u['role'] == 'hr'])
+    supervisors = [u for u in user_rows if u['role'] == 'supervisor']
+    ids.update(insert_users(supervisors))
+    supervisor_ids = [ids[u['employee_id']] for u in supervisors]
+    members = [u for u in user_rows if u['role'] == 'employee']
+    for u in members:
+        u['supervisor_id'] = rng.choice(supervisor_ids)
+    if members:
+        ids.update(insert_users(members))
+    team_of = {ids[u['employee_id']]: u['supervisor_id'] for u in members}
+
+    taken = set(h.date for h in Holiday.query.all())
+    holiday_rows = _holidays(rng, history_start.year, (today + timedelta(days=leave_horizon_days)).year, taken)
+    _chunked_insert(db, Holiday, holiday_rows)
+    counts = {'users': len(user_rows), 'holidays': len(holiday_rows), 'leave_requests': 0, 'attendance': 0, 'personal_tasks': 0}
+
+    leave_rows, attendance_rows, task_rows = [], [], []
+    def flush(final=False):
+        for Model, rows, key in ((LeaveRequest, leave_rows, 'leave_requests'), (Attendance, attendance_rows, 'attendance'),
+                                 (PersonalTask, task_rows, 'personal_tasks')):
+            if rows and (final or len(rows) >= CHUNK_ROWS):
+                _chunked_insert(db, Model, rows)
+                counts[key] += len(rows)
+                rows.clear()
+
+    for u in user_rows:
+        user_id = ids[u['employee_id']]
+        first_day = max(u['date_of_joining'], history_start)
+        leaves = _leave_history(rng, user_id, first_day, today, leave_horizon_days)
+        leave_rows.extend(leaves)
+
+        on_leave = set()
+        for l in leaves:
+            if l['status'] == 'Approved':
+                on_leave.update(l['start_date'] + timedelta(days=k) for k in range((l['end_date'] - l['start_date']).days + 1))
+        marked_by = team_of.get(user_id)
+        day = first_day
+        while day <= today:
+            if day.weekday() != 6 and day not in taken:
+                attendance_rows.append({'user_id': user_id, 'date': day, 'marked_by': marked_by,
+                                        'status': 'Leave' if day in on_leave else 'Present'})
+            day += timedelta(days=1)
+
+        months = max(1, (today - first_day).days // 30)
+        for _ in range(months * TASKS_PER_MONTH):
+            task_rows.append({'user_id': user_id, 'date': first_day + timedelta(days=rng.randrange((today - first_day).days + 1)),
+                              'task_description': rng.choice(TASKS)})
+        flush()
+    flush(final=True)
+    db.session.commit()
+    return counts